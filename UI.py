@@ -3,13 +3,71 @@
 import os
 import sys
 import functools
+import threading
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
 from PyQt5.QtGui import QIcon
 
 from midi import *
 from PyQt5.QtWidgets import QApplication, QWidget, QGroupBox, QRadioButton, QGridLayout, QFileDialog, QVBoxLayout, \
-    QComboBox, QPushButton, QHBoxLayout, QLineEdit, QLabel, QMainWindow, QSpinBox, QCheckBox, QMessageBox
+    QComboBox, QPushButton, QHBoxLayout, QLineEdit, QLabel, QMainWindow, QSpinBox, QCheckBox, QMessageBox, \
+    QProgressBar
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class GenerationSignals(QObject):
+    progress = pyqtSignal(int)
+    finished = pyqtSignal()
+    cancelled = pyqtSignal()
+    # Window title, text and informative text of the error
+    failed = pyqtSignal(str, str, str)
+
+
+class GenerationTask(QRunnable):
+
+    def __init__(self, riff: Riff, path: str):
+        super().__init__()
+        self.riff = riff
+        self.path = path
+        self.signals = GenerationSignals()
+        self.cancel_requested = threading.Event()
+
+    def cancel(self):
+        self.cancel_requested.set()
+
+    def notes(self):
+        total = self.riff.number_notes
+        for index, note in enumerate(self.riff.iter_notes()):
+            if index % STREAM_CHUNK_NOTES == 0:
+                if self.cancel_requested.is_set():
+                    raise GenerationCancelled()
+                self.signals.progress.emit(index * 100 // total)
+            yield note
+
+    def run(self):
+        try:
+            file = open(self.path, "wb")
+        except PermissionError:
+            self.signals.failed.emit("Error opening file", "You do not have permission to write in {}".format(
+                self.path[:self.path.rfind('/')+1]), "")
+            return
+        except OSError as e:
+            self.signals.failed.emit("Error opening file", "Could not open {}".format(self.path), str(e))
+            return
+        try:
+            with file:
+                write_stream(self.notes(), file, self.riff.division)
+        except GenerationCancelled:
+            os.remove(self.path)
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit("Critical Error", "An error occurred while writing the MIDI file", str(e))
+        else:
+            self.signals.progress.emit(100)
+            self.signals.finished.emit()
 
 
 class GeneratorWindow(QMainWindow):
@@ -27,6 +85,7 @@ class GeneratorWindow(QMainWindow):
         }
         self.number_of_notes = None
         self.use_specific_scale = False
+        self.task = None
 
         # UI setup
         self.setGeometry(150, 100, 700, 300)
@@ -49,11 +108,28 @@ class GeneratorWindow(QMainWindow):
         self.setup_number_of_notes()
         self.setup_rhythm()
 
-        generate_button = QPushButton()
-        generate_button.setText("Generate Riff!")
-        generate_button.clicked.connect(self.generate)
+        self.generate_button = QPushButton()
+        self.generate_button.setText("Generate Riff!")
+        self.generate_button.clicked.connect(self.generate)
+
+        self.main_layout.addWidget(self.generate_button)
+        self.setup_progress()
 
-        self.main_layout.addWidget(generate_button)
+    def setup_progress(self):
+        progress_layout = QHBoxLayout()
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
+
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_generation)
+
+        progress_layout.addWidget(self.progress_bar)
+        progress_layout.addWidget(self.cancel_button)
+
+        self.main_layout.addLayout(progress_layout)
 
     def setup_file_path(self):
         file_layout = QVBoxLayout()
@@ -129,7 +205,7 @@ class GeneratorWindow(QMainWindow):
         number_group_box_layout = QVBoxLayout()
         number_of_notes = QSpinBox()
         number_of_notes.setMinimum(1)
-        number_of_notes.setMaximum(8161)
+        number_of_notes.setMaximum(MAX_NOTES)
         number_of_notes.setValue(1)
         number_of_notes.valueChanged.connect(self.number_of_notes_changed)
 
@@ -225,52 +301,61 @@ class GeneratorWindow(QMainWindow):
             alert.setStandardButtons(QMessageBox.Close)
             alert.exec_()
             return
-        try:
-            file = open(self.file, "wb", buffering=1)
-        except PermissionError:
-            alert = QMessageBox()
-            alert.setIcon(QMessageBox.Critical)
-            alert.setText("You do not have permission to write in {}".format(self.file[:self.file.rfind('/')+1]))
-            alert.setWindowTitle("Error opening file")
-            alert.setStandardButtons(QMessageBox.Close)
-            alert.exec_()
-            return
         riff = Riff(scale=self.selected_scale if self.use_specific_scale else None,
                     root=self.selected_root if self.use_specific_scale else None, number_notes=self.number_of_notes,
                     allowed_rhythm=[length for length in self.allowed_rhythm.keys() if self.allowed_rhythm[length]])
-        riff.populate()
-        try:
-            write(riff, file)
-            file.close()
-            alert = QMessageBox()
-            alert.setIcon(QMessageBox.Information)
-            alert.setText("The MIDI file has correcty been generated")
-            alert.setWindowTitle("Confirmation")
-            alert.setStandardButtons(QMessageBox.Ok)
-            open_in_musescore_button = QPushButton()
-            open_in_musescore_button.setText("Open in MuseScore")
-            alert.addButton(open_in_musescore_button, QMessageBox.YesRole)
-            alert.exec_()
-            if alert.clickedButton() == open_in_musescore_button:
-                os.system('musescore3 {} &'.format(self.file))
-        except MIDIWritingError as e:
-            alert = QMessageBox()
-            alert.setIcon(QMessageBox.Critical)
-            alert.setText("An error occurred while writing the MIDI file")
-            alert.setInformativeText(str(e))
-            alert.setWindowTitle("Critical Error")
-            alert.setStandardButtons(QMessageBox.Close)
-            alert.exec_()
-        except Exception as e:
-            alert = QMessageBox()
-            alert.setIcon(QMessageBox.Critical)
-            alert.setText("An error occurred while writing the MIDI file")
-            alert.setInformativeText(str(e))
-            alert.setWindowTitle("Critical Error")
-            alert.setStandardButtons(QMessageBox.Close)
-            alert.exec_()
-        finally:
-            file.close()
+
+        # Generation and writing run on the thread pool so the window stays responsive
+        self.task = GenerationTask(riff, self.file)
+        self.task.signals.progress.connect(self.progress_bar.setValue)
+        self.task.signals.finished.connect(self.generation_finished)
+        self.task.signals.cancelled.connect(self.generation_cancelled)
+        self.task.signals.failed.connect(self.generation_failed)
+
+        self.progress_bar.setValue(0)
+        self.generate_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        QThreadPool.globalInstance().start(self.task)
+
+    def cancel_generation(self):
+        if self.task:
+            self.task.cancel()
+            self.cancel_button.setEnabled(False)
+
+    def generation_done(self):
+        self.task = None
+        self.generate_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+    def generation_finished(self):
+        file = self.task.path
+        self.generation_done()
+        alert = QMessageBox()
+        alert.setIcon(QMessageBox.Information)
+        alert.setText("The MIDI file has correcty been generated")
+        alert.setWindowTitle("Confirmation")
+        alert.setStandardButtons(QMessageBox.Ok)
+        open_in_musescore_button = QPushButton()
+        open_in_musescore_button.setText("Open in MuseScore")
+        alert.addButton(open_in_musescore_button, QMessageBox.YesRole)
+        alert.exec_()
+        if alert.clickedButton() == open_in_musescore_button:
+            os.system('musescore3 {} &'.format(file))
+
+    def generation_cancelled(self):
+        self.generation_done()
+        self.progress_bar.setValue(0)
+
+    def generation_failed(self, title: str, text: str, informative_text: str):
+        self.generation_done()
+        alert = QMessageBox()
+        alert.setIcon(QMessageBox.Critical)
+        alert.setText(text)
+        if informative_text:
+            alert.setInformativeText(informative_text)
+        alert.setWindowTitle(title)
+        alert.setStandardButtons(QMessageBox.Close)
+        alert.exec_()
 
 
 def window():
@@ -0,0 +1,167 @@
+import argparse
+import os
+import random
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Iterator, Union, Tuple
+
+from cli import add_riff_arguments, check_riff_options
+from dedup import Deduplicator, riff_key
+from markov import MarkovModel
+from rhythm import DEFAULT_BEATS_PER_BAR
+from midi import Riff, Scale, NoteValue, NoteLength, DEFAULT_DIVISION, encode, derive_seed, import_numpy
+from sinks import open_sink
+
+
+# Riffs drawn together by the vectorized mode. The blocks cover fixed ranges of indices and are seeded from their
+# position, so the riffs do not depend on how the batch is split in chunks either.
+VECTORIZED_BLOCK_RIFFS = 64
+
+
+def batch_riff(seed: int, index: int, scale: Scale = None, root: NoteValue = None, number_notes: int = None,
+               allowed_rhythm: List[NoteLength] = None, vectorized: bool = False,
+               division: int = DEFAULT_DIVISION, model: MarkovModel = None, bars: int = None,
+               beats_per_bar: int = DEFAULT_BEATS_PER_BAR) -> Riff:
+    riff_seed = derive_seed(seed, index)
+    rng = import_numpy().random.default_rng(riff_seed) if vectorized else random.Random(riff_seed)
+    return Riff(scale=scale, root=root, number_notes=number_notes, allowed_rhythm=allowed_rhythm, rng=rng,
+                division=division, model=model, bars=bars, beats_per_bar=beats_per_bar)
+
+
+def batch_block(seed: int, block: int, scale: Scale = None, root: NoteValue = None, number_notes: int = None,
+                allowed_rhythm: List[NoteLength] = None, division: int = DEFAULT_DIVISION,
+                model: MarkovModel = None, bars: int = None,
+                beats_per_bar: int = DEFAULT_BEATS_PER_BAR) -> List[Riff]:
+    # Negative indices keep the block seeds apart from the seeds of single riffs
+    generator = import_numpy().random.default_rng(derive_seed(seed, -1 - block))
+    template = Riff(scale=scale, root=root, number_notes=number_notes, allowed_rhythm=allowed_rhythm, rng=generator,
+                    division=division, model=model, bars=bars, beats_per_bar=beats_per_bar)
+    return template.populate_many(VECTORIZED_BLOCK_RIFFS, generator)
+
+
+def generate_chunk(seed: int, start: int, count: int, scale: Scale = None, root: NoteValue = None,
+                   number_notes: int = None, allowed_rhythm: List[NoteLength] = None,
+                   vectorized: bool = False, division: int = DEFAULT_DIVISION, compact: bool = False,
+                   model: MarkovModel = None, bars: int = None, beats_per_bar: int = DEFAULT_BEATS_PER_BAR,
+                   keys: bool = False, transpose: bool = False) -> List[Union[bytes, Tuple[bytes, bytes]]]:
+    riffs = []
+    if vectorized and (number_notes or bars):
+        # Riffs of a known length are drawn by blocks, the blocks overlapping the chunk are drawn whole
+        end = start + count
+        for block in range(start // VECTORIZED_BLOCK_RIFFS, (end - 1) // VECTORIZED_BLOCK_RIFFS + 1):
+            block_start = block * VECTORIZED_BLOCK_RIFFS
+            riffs += batch_block(seed, block, scale, root, number_notes, allowed_rhythm, division, model, bars,
+                                 beats_per_bar)[max(start - block_start, 0):end - block_start]
+    else:
+        # Each riff is drawn from its own stream, so that any riff can be regenerated on its own
+        for index in range(start, start + count):
+            riff = batch_riff(seed, index, scale, root, number_notes, allowed_rhythm, vectorized, division, model,
+                              bars, beats_per_bar)
+            riff.populate()
+            riffs.append(riff)
+
+    if not keys:
+        return [bytes(encode(riff, compact)) for riff in riffs]
+    # Duplicates within the chunk are dropped before being encoded, the keys of the others are checked against every
+    # riff already written by the parent process
+    unique = {}
+    for riff in riffs:
+        unique.setdefault(riff_key(riff.notes, transpose), riff)
+    return [(key, bytes(encode(riff, compact))) for key, riff in unique.items()]
+
+
+def iter_batch(n: int, scale: Scale = None, root: NoteValue = None, number_notes: int = None,
+               allowed_rhythm: List[NoteLength] = None, seed: int = 0, workers: int = None,
+               chunk_size: int = 256, vectorized: bool = False, division: int = DEFAULT_DIVISION,
+               compact: bool = False, model: MarkovModel = None, bars: int = None,
+               beats_per_bar: int = DEFAULT_BEATS_PER_BAR, keys: bool = False,
+               transpose: bool = False) -> Iterator[Union[bytes, Tuple[bytes, bytes]]]:
+    workers = workers or os.cpu_count() or 1
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, n, chunk_size):
+            # Bound the number of chunks in flight so results are streamed instead of accumulated
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+            pending.append(executor.submit(generate_chunk, seed, start, min(chunk_size, n - start), scale, root,
+                                           number_notes, allowed_rhythm, vectorized, division, compact, model,
+                                           bars, beats_per_bar, keys, transpose))
+        while pending:
+            yield from pending.popleft().result()
+
+
+def generate_batch(n: int, scale: Scale = None, root: NoteValue = None, number_notes: int = None,
+                   allowed_rhythm: List[NoteLength] = None, output: str = "riffs", seed: int = 0,
+                   workers: int = None, chunk_size: int = 256, vectorized: bool = False,
+                   division: int = DEFAULT_DIVISION, compact: bool = False, model: MarkovModel = None,
+                   bars: int = None, beats_per_bar: int = DEFAULT_BEATS_PER_BAR,
+                   dedup: Deduplicator = None) -> int:
+    # Returns the number of riffs written, which is lower than n when duplicates are skipped
+    written = 0
+    sink = open_sink(output, division)
+    try:
+        for item in iter_batch(n, scale=scale, root=root, number_notes=number_notes, allowed_rhythm=allowed_rhythm,
+                               seed=seed, workers=workers, chunk_size=chunk_size, vectorized=vectorized,
+                               division=division, compact=compact, model=model, bars=bars,
+                               beats_per_bar=beats_per_bar, keys=dedup is not None,
+                               transpose=dedup is not None and dedup.transpose):
+            if dedup is None:
+                sink.add(written, item)
+            else:
+                key, data = item
+                if dedup.is_duplicate(key):
+                    continue
+                # Recorded only once the sink took the riff
+                sink.add(written, data)
+                dedup.add_key(key)
+            written += 1
+    finally:
+        # Closing commits the riffs written so far, their keys are committed only if that succeeded
+        sink.close()
+        if dedup is not None:
+            dedup.commit()
+    return written
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Generate a batch of random MIDI riffs")
+    parser.add_argument("count", type=int, help="number of riffs to generate")
+    parser.add_argument("-o", "--output", default="riffs",
+                        help="output directory, or a .tar, .zip, .riffs container or multi-track .mid file to stream "
+                             "the riffs into")
+    add_riff_arguments(parser)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, help="number of worker processes (defaults to the CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="number of riffs generated per task")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="draw the notes with numpy, by blocks of {} riffs".format(VECTORIZED_BLOCK_RIFFS))
+    parser.add_argument("--compact", action="store_true", help="omit repeated note on status bytes")
+    parser.add_argument("--dedup", action="store_true", help="skip riffs identical to one already written")
+    parser.add_argument("--dedup-index", metavar="FILE",
+                        help="file keeping the keys of the riffs written across runs, implies --dedup")
+    parser.add_argument("--transpose-invariant", action="store_true",
+                        help="consider transposed riffs as duplicates, implies --dedup")
+    parser.add_argument("--bloom", type=int, metavar="CAPACITY",
+                        help="keep the keys in a Bloom filter sized for that many riffs instead of a set, implies "
+                             "--dedup")
+    args = parser.parse_args(argv)
+    options = check_riff_options(parser, args)
+
+    dedup = None
+    if args.dedup or args.dedup_index or args.transpose_invariant or args.bloom:
+        dedup = Deduplicator(args.dedup_index, args.transpose_invariant, args.bloom)
+    try:
+        written = generate_batch(args.count, **options, output=args.output, seed=args.seed,
+                                 workers=args.workers, chunk_size=args.chunk_size, vectorized=args.vectorized,
+                                 compact=args.compact, dedup=dedup)
+    finally:
+        if dedup is not None:
+            dedup.close()
+    if dedup is not None:
+        print("{} riffs written, {} duplicates skipped".format(written, args.count - written), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from typing import List, Dict, Callable, Tuple
+
+from midi import Riff, Scale, NoteValue, MTHD_HEADER, encode, write, write_mtrk
+
+NOTE_COUNTS = (1, 16, 8161, 10 ** 6)
+MODES = {
+    "scale": (Scale.MAJOR_SCALE, NoteValue.C),
+    "chromatic": (None, None),
+}
+# Each measurement is the best of a few runs, every run calling the benchmarked function enough times to last about
+# 0.2 seconds
+REPEAT = 3
+
+
+def measure(function: Callable[[], object], repeat: int = REPEAT) -> float:
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    if repeat > 1:
+        elapsed = min([elapsed] + timer.repeat(repeat - 1, number))
+    return elapsed / number
+
+
+def write_disk(riff: Riff, path: str):
+    with open(path, "wb") as file:
+        write(riff, file)
+
+
+def riff_benchmarks(mode: str, number_notes: int,
+                    directory: str) -> List[Tuple[str, Callable[[], object], bool, int]]:
+    scale, root = MODES[mode]
+    riff = Riff(scale=scale, root=root, number_notes=number_notes, seed=0)
+    riff.populate()
+    size = len(encode(riff))
+    path = os.path.join(directory, "{}_{}.mid".format(mode, number_notes))
+    # Name, function, whether it handles every note and number of bytes it produces
+    return [
+        ("init", lambda: Riff(scale=scale, root=root, number_notes=number_notes, seed=0), False, 0),
+        ("populate", riff.populate, True, 0),
+        ("write_mtrk", lambda: write_mtrk(riff, io.BytesIO()), True, size - MTHD_HEADER.size),
+        ("write_bytesio", lambda: write(riff, io.BytesIO()), True, size),
+        ("write_disk", lambda: write_disk(riff, path), True, size),
+    ]
+
+
+def run(note_counts: List[int] = NOTE_COUNTS, modes: List[str] = None, repeat: int = REPEAT,
+        verbose: bool = False) -> List[Dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in modes or MODES:
+            for number_notes in note_counts:
+                for name, function, per_note, size in riff_benchmarks(mode, number_notes, directory):
+                    seconds = measure(function, repeat)
+                    result = {
+                        "benchmark": name,
+                        "mode": mode,
+                        "notes": number_notes,
+                        "seconds": seconds,
+                        "riffs_per_second": 1 / seconds,
+                    }
+                    if per_note:
+                        result["notes_per_second"] = number_notes / seconds
+                    if size:
+                        result["megabytes_per_second"] = size / seconds / 1e6
+                    results.append(result)
+                    if verbose:
+                        print(format_result(result), file=sys.stderr)
+    return results
+
+
+def format_result(result: Dict) -> str:
+    line = "{benchmark:>14} {mode:>9} {notes:>8} notes: {seconds:.3e} s, {riffs_per_second:12.1f} riffs/s".format(
+        **result)
+    if "notes_per_second" in result:
+        line += ", {:12.0f} notes/s".format(result["notes_per_second"])
+    if "megabytes_per_second" in result:
+        line += ", {:8.1f} MB/s".format(result["megabytes_per_second"])
+    return line
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: Dict, results: List[Dict]):
+    before = {(result["benchmark"], result["mode"], result["notes"]): result["seconds"]
+              for result in previous["results"]}
+    print("Compared to {}:".format(previous.get("commit")), file=sys.stderr)
+    for result in results:
+        key = (result["benchmark"], result["mode"], result["notes"])
+        if key in before:
+            print("{:>14} {:>9} {:>8} notes: {:6.2f}x".format(*key, before[key] / result["seconds"]), file=sys.stderr)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Measure the throughput of riff generation, encoding and writing")
+    parser.add_argument("-o", "--output", default="-", help="JSON results file, - for the standard output (default)")
+    parser.add_argument("--notes", type=int, action="append", help="note count to measure, may be repeated")
+    parser.add_argument("--mode", action="append", choices=list(MODES), help="note selection mode, may be repeated")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="number of runs of each measurement")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print results as they are measured")
+    args = parser.parse_args(argv)
+
+    results = run(args.notes or NOTE_COUNTS, args.mode, args.repeat, not args.quiet)
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), results)
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, BinaryIO, Dict, Optional
+
+from midi import Riff, Scale, NoteValue, NoteLength, DEFAULT_DIVISION, encode, rhythm_to_ticks, write_all
+
+# Bump whenever the encoded output for a given set of parameters changes
+CACHE_VERSION = 4
+
+
+def cache_key(scale: Scale = None, root: NoteValue = None, number_notes: int = None,
+              allowed_rhythm: List[NoteLength] = None, seed: int = None, division: int = DEFAULT_DIVISION,
+              compact: bool = False) -> str:
+    parameters = "{}|{}|{}|{}|{}|{}|{}|{}".format(CACHE_VERSION,
+                                                  scale.name if scale else None,
+                                                  int(root) if root else None,
+                                                  number_notes,
+                                                  ",".join(map(str, rhythm_to_ticks(allowed_rhythm or (), division))),
+                                                  seed,
+                                                  division,
+                                                  compact)
+    return hashlib.sha256(parameters.encode()).hexdigest()
+
+
+class DiskStore:
+    def __init__(self, path: str, max_size: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        # Least recently used entries first
+        self.entries: Dict[str, int] = OrderedDict()
+        os.makedirs(path, exist_ok=True)
+
+        files = []
+        for name in os.listdir(path):
+            if name.endswith(".mid"):
+                stat = os.stat(os.path.join(path, name))
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.size += size
+
+    def file_path(self, key: str) -> str:
+        return os.path.join(self.path, key + ".mid")
+
+    def get(self, key: str) -> Optional[bytes]:
+        if key not in self.entries:
+            return None
+        try:
+            with open(self.file_path(key), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            self.size -= self.entries.pop(key)
+            return None
+        os.utime(self.file_path(key))
+        self.entries.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_size:
+            return
+        # Write to a temporary file first so readers never see a partial entry
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as file:
+            write_all(file, data, "cached MIDI file")
+        os.replace(temporary_path, self.file_path(key))
+
+        self.size += len(data) - self.entries.pop(key, 0)
+        self.entries[key] = len(data)
+        while self.size > self.max_size:
+            evicted, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.file_path(evicted))
+            except FileNotFoundError:
+                pass
+
+
+class RiffCache:
+    def __init__(self, max_entries: int = 1024, directory: str = None, max_disk_size: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.memory: Dict[str, bytes] = OrderedDict()
+        self.disk = DiskStore(directory, max_disk_size) if directory else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return data
+            if self.disk:
+                data = self.disk.get(key)
+                if data is not None:
+                    self.disk_hits += 1
+                    self.remember(key, data)
+                    return data
+            self.misses += 1
+            return None
+
+    def put(self, key: str, data: bytes):
+        with self.lock:
+            self.remember(key, data)
+            if self.disk:
+                self.disk.put(key, data)
+
+    def remember(self, key: str, data: bytes):
+        self.memory[key] = data
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def encode(self, scale: Scale = None, root: NoteValue = None, number_notes: int = None,
+               allowed_rhythm: List[NoteLength] = None, seed: int = None, division: int = DEFAULT_DIVISION,
+               compact: bool = False) -> bytes:
+        if seed is None:
+            # Unseeded riffs are random on every call, there is nothing to cache
+            riff = Riff(scale=scale, root=root, number_notes=number_notes, allowed_rhythm=allowed_rhythm,
+                        division=division)
+            riff.populate()
+            return bytes(encode(riff, compact))
+
+        key = cache_key(scale, root, number_notes, allowed_rhythm, seed, division, compact)
+        data = self.get(key)
+        if data is None:
+            riff = Riff(scale=scale, root=root, number_notes=number_notes, allowed_rhythm=allowed_rhythm, seed=seed,
+                        division=division)
+            riff.populate()
+            data = bytes(encode(riff, compact))
+            self.put(key, data)
+        return data
+
+    def write(self, file: BinaryIO, scale: Scale = None, root: NoteValue = None, number_notes: int = None,
+              allowed_rhythm: List[NoteLength] = None, seed: int = None, division: int = DEFAULT_DIVISION,
+              compact: bool = False):
+        write_all(file, self.encode(scale, root, number_notes, allowed_rhythm, seed, division, compact), "MIDI file")
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self.memory),
+                "disk_entries": len(self.disk.entries) if self.disk else 0,
+                "disk_size": self.disk.size if self.disk else 0,
+            }
@@ -0,0 +1,83 @@
+import argparse
+import sys
+from typing import List, Dict
+
+from markov import MarkovModel
+from midi import Riff, Scale, NoteValue, NoteLength, MIDIWritingError, DEFAULT_DIVISION, write_stream
+from rhythm import DEFAULT_BEATS_PER_BAR, count_rhythms
+
+
+def add_riff_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--scale", choices=[scale.name for scale in Scale])
+    parser.add_argument("--root", choices=list(NoteValue.__members__))
+    parser.add_argument("--notes", type=int, help="number of notes per riff (random between 1 and 16 if omitted)")
+    parser.add_argument("--rhythm", action="append", choices=[length.name for length in NoteLength],
+                        help="allowed note length, may be repeated")
+    parser.add_argument("--division", type=int, default=DEFAULT_DIVISION, help="ticks per quarter note")
+    parser.add_argument("--bars", type=int,
+                        help="fill exactly this many bars, the number of notes follows. At most 128 bars of 4/4 when "
+                             "sixty-fourth notes are allowed, more with longer notes only")
+    parser.add_argument("--beats-per-bar", type=int, default=DEFAULT_BEATS_PER_BAR, help="quarter notes per bar")
+    parser.add_argument("--markov", action="store_true",
+                        help="draw each note from the previous one, favouring small intervals and repeated lengths")
+
+
+def riff_options(args: argparse.Namespace) -> Dict:
+    return {
+        "scale": Scale[args.scale] if args.scale else None,
+        "root": NoteValue[args.root] if args.root else None,
+        "number_notes": args.notes,
+        "allowed_rhythm": [NoteLength[name] for name in args.rhythm] if args.rhythm else None,
+        "division": args.division,
+        "model": MarkovModel() if args.markov else None,
+        "bars": args.bars,
+        "beats_per_bar": args.beats_per_bar,
+    }
+
+
+def check_riff_options(parser: argparse.ArgumentParser, args: argparse.Namespace) -> Dict:
+    # Reports invalid options before any riff is generated, in worker processes for instance
+    options = riff_options(args)
+    try:
+        riff = Riff(**options)
+        if riff.total_ticks and not count_rhythms(riff.rhythm_ticks, riff.total_ticks):
+            parser.exit(1, "No rhythm made of the allowed note lengths fills exactly {} bars\n".format(args.bars))
+    except ValueError as e:
+        parser.error(str(e))
+    return options
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Generate a random MIDI riff")
+    add_riff_arguments(parser)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("-o", "--output", default="-", help="output file, - for the standard output (default)")
+    parser.add_argument("--compact", action="store_true", help="omit repeated note on status bytes")
+    parser.add_argument("--profile", nargs="?", const="", metavar="STATS_FILE",
+                        help="report the time spent in each stage, cProfile and tracemalloc statistics on the standard "
+                             "error, and dump the cProfile statistics to STATS_FILE when given")
+    args = parser.parse_args(argv)
+
+    if args.profile is not None:
+        # Only imported when profiling as cProfile and tracemalloc slow down the start of the command line tool
+        from instrumentation import profile
+        profile(lambda: generate(parser, args), args.profile)
+    else:
+        generate(parser, args)
+
+
+def generate(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    riff = Riff(**check_riff_options(parser, args), seed=args.seed)
+    try:
+        if args.output == "-":
+            write_stream(riff.iter_notes(), sys.stdout.buffer, riff.division, compact=args.compact)
+            sys.stdout.buffer.flush()
+        else:
+            with open(args.output, "wb") as file:
+                write_stream(riff.iter_notes(), file, riff.division, compact=args.compact)
+    except (MIDIWritingError, OSError) as e:
+        parser.exit(1, "Error when writing the MIDI file: {}\n".format(e))
+
+
+if __name__ == '__main__':
+    main()
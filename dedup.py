@@ -0,0 +1,158 @@
+import hashlib
+import math
+import os
+from functools import lru_cache
+from typing import List, Union
+
+from midi import NoteArray, REST, write_all
+
+# Size of the riff keys, large enough for collisions to be negligible across billions of riffs
+KEY_SIZE = 16
+
+
+@lru_cache(maxsize=None)
+def transposition_table(base: int) -> bytes:
+    # Moves every pitch so that the base becomes 0, leaving the rests alone
+    return bytes((pitch - base) % 0x80 if pitch < 0x80 else pitch for pitch in range(256))
+
+
+def riff_key(notes: NoteArray, transpose: bool = False) -> bytes:
+    # Hash of the pitches and lengths of the notes. Transposition invariant keys are computed on the pitches relative to
+    # the first note, so that the same riff built on another root has the same key
+    pitches = memoryview(notes.pitches).cast('B').tobytes()
+    if transpose:
+        first = pitches.lstrip(bytes((REST,)))[:1]
+        if first:
+            pitches = pitches.translate(transposition_table(first[0]))
+    key = hashlib.blake2b(pitches, digest_size=KEY_SIZE)
+    key.update(memoryview(notes.lengths).cast('B'))
+    return key.digest()
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("Invalid Bloom filter capacity {} or error rate {}".format(capacity, error_rate))
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: bytes):
+        # Double hashing on the two halves of the key, which is already a uniform hash
+        first = int.from_bytes(key[:8], 'little')
+        second = int.from_bytes(key[8:16], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+    def add(self, key: bytes) -> bool:
+        # Returns whether the key was new, with false negatives at the error rate
+        new = False
+        bits = self.bits
+        for position in self.positions(key):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                new = True
+        self.count += new
+        return new
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class KeySet:
+    def __init__(self):
+        self.keys = set()
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self.keys
+
+    def add(self, key: bytes) -> bool:
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+class Deduplicator:
+    def __init__(self, path: str = None, transpose: bool = False, bloom_capacity: int = None,
+                 error_rate: float = 0.001):
+        # Keys are kept in a set, or in a Bloom filter of the given capacity to bound the memory used at the cost of
+        # dropping a few unique riffs. With a path, the keys are appended to that file on commit and loaded back on the
+        # next run.
+        self.transpose = transpose
+        self.seen: Union[KeySet, BloomFilter] = BloomFilter(bloom_capacity, error_rate) if bloom_capacity else \
+            KeySet()
+        self.duplicates = 0
+        # Keys of the riffs added since the last commit, not in the file yet
+        self.pending: List[bytes] = []
+        self.file = None
+        if path:
+            self.load(path)
+            self.file = open(path, "ab")
+
+    def load(self, path: str):
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as file:
+            data = file.read()
+        # A run interrupted in the middle of a write leaves a partial key behind, which is dropped
+        end = len(data) - len(data) % KEY_SIZE
+        if end != len(data):
+            with open(path, "r+b") as file:
+                file.truncate(end)
+        for offset in range(0, end, KEY_SIZE):
+            self.seen.add(data[offset:offset + KEY_SIZE])
+
+    def key(self, notes: NoteArray) -> bytes:
+        return riff_key(notes, self.transpose)
+
+    def is_duplicate(self, key: bytes) -> bool:
+        # Checks a key without adding it, so that it is only recorded once its riff has been written
+        if key in self.seen:
+            self.duplicates += 1
+            return True
+        return False
+
+    def add_key(self, key: bytes) -> bool:
+        if not self.seen.add(key):
+            self.duplicates += 1
+            return False
+        if self.file is not None:
+            self.pending.append(key)
+        return True
+
+    def add(self, notes: NoteArray) -> bool:
+        # Returns whether the riff had not been seen yet
+        return self.add_key(self.key(notes))
+
+    def __len__(self) -> int:
+        return len(self.seen)
+
+    def commit(self):
+        # Called once the output holding the added riffs has been committed, for instance when a container has written
+        # its trailer, so that the file never has the key of a riff that was lost
+        if self.file is not None and self.pending:
+            write_all(self.file, b''.join(self.pending), "deduplication index")
+            self.file.flush()
+        self.pending.clear()
+
+    def close(self):
+        # Keys that were not committed are dropped along with their riffs
+        self.pending.clear()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
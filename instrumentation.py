@@ -0,0 +1,97 @@
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import tracemalloc
+from typing import Callable, Dict, Optional, TextIO, Any
+
+import midi
+
+# Called with the stage, the time it took in seconds, the number of notes and the number of bytes it handled
+MetricsCallback = Callable[[str, float, int, int], None]
+
+STAGES = ("init", "populate", "encode", "write")
+
+
+class StageMetrics:
+    __slots__ = ('calls', 'seconds', 'notes', 'bytes')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.notes = 0
+        self.bytes = 0
+
+
+class Metrics:
+    def __init__(self, callback: MetricsCallback = None):
+        self.callback = callback
+        self.stages: Dict[str, StageMetrics] = {stage: StageMetrics() for stage in STAGES}
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, notes: int = 0, size: int = 0):
+        with self.lock:
+            metrics = self.stages.get(stage)
+            if metrics is None:
+                metrics = self.stages[stage] = StageMetrics()
+            metrics.calls += 1
+            metrics.seconds += seconds
+            metrics.notes += notes
+            metrics.bytes += size
+        if self.callback is not None:
+            self.callback(stage, seconds, notes, size)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {stage: {name: getattr(metrics, name) for name in StageMetrics.__slots__}
+                    for stage, metrics in self.stages.items()}
+
+    def report(self) -> str:
+        lines = ["{:>10} {:>10} {:>12} {:>12} {:>14}".format("stage", "calls", "seconds", "notes", "bytes")]
+        for stage, metrics in self.snapshot().items():
+            lines.append("{:>10} {calls:>10} {seconds:>12.6f} {notes:>12} {bytes:>14}".format(stage, **metrics))
+        return "\n".join(lines)
+
+
+def enable(callback: MetricsCallback = None) -> Metrics:
+    midi.metrics = Metrics(callback)
+    return midi.metrics
+
+
+def disable() -> Optional[Metrics]:
+    metrics = midi.metrics
+    midi.metrics = None
+    return metrics
+
+
+def profile(function: Callable[[], Any], output: str = None, stream: TextIO = sys.stderr,
+            limit: int = 25) -> Any:
+    # Runs the function with the stage metrics, cProfile and tracemalloc enabled and reports all three to the stream.
+    # The cProfile statistics are also dumped to the output file when given, to be loaded with pstats or snakeviz.
+    metrics = enable()
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        profiler.enable()
+        try:
+            return function()
+        finally:
+            profiler.disable()
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        disable()
+
+        print("Stages:\n{}\n".format(metrics.report()), file=stream)
+
+        statistics = io.StringIO()
+        pstats.Stats(profiler, stream=statistics).sort_stats("cumulative").print_stats(limit)
+        print(statistics.getvalue(), file=stream)
+        if output:
+            profiler.dump_stats(output)
+
+        print("Memory: {} bytes allocated, {} bytes at peak".format(current, peak), file=stream)
+        for statistic in snapshot.statistics("lineno")[:limit // 2]:
+            print(statistic, file=stream)
@@ -0,0 +1,210 @@
+import argparse
+import math
+import queue
+import sys
+import threading
+import time
+from array import array
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from cli import add_riff_arguments, check_riff_options
+from midi import Riff, REST, DEFAULT_DIVISION, NOTE_ON_STATUS
+
+# Quarter notes per minute
+DEFAULT_TEMPO = 120
+# Time left to generate the first notes before the first event is due
+LEAD_TIME = 0.01
+# The scheduler sleeps until that long before an event and busy waits for the rest, sleeping alone can overshoot by
+# more than a millisecond
+SPIN_TIME = 0.002
+
+NOTE_VELOCITY = 0x40
+# Control change on the first channel silencing every note, sent when the playback is stopped
+ALL_NOTES_OFF = bytes((0xb0, 0x7b, 0x00))
+
+
+def note_on(pitch: int) -> bytes:
+    return NOTE_ON_STATUS + bytes((pitch, NOTE_VELOCITY))
+
+
+def note_off(pitch: int) -> bytes:
+    # A note on with a null velocity, as in the files written by midi
+    return NOTE_ON_STATUS + bytes((pitch, 0))
+
+
+def iter_timed_events(notes: Iterable[Tuple[int, int]]) -> Iterator[Tuple[int, bytes]]:
+    # Tick at which each message is due, rests only move the time forward
+    tick = 0
+    for pitch, length in notes:
+        if pitch != REST:
+            yield tick, note_on(pitch)
+            yield tick + length, note_off(pitch)
+        tick += length
+
+
+class PipeSink:
+    def __init__(self, file: BinaryIO):
+        # Raw MIDI messages, as expected by a MIDI device file or a serial MIDI interface
+        self.file = file
+
+    def send(self, message: bytes, timestamp: float):
+        self.file.write(message)
+        self.file.flush()
+
+    def close(self):
+        pass
+
+
+class CallbackSink:
+    def __init__(self, callback: Callable[[bytes, float], None]):
+        self.callback = callback
+
+    def send(self, message: bytes, timestamp: float):
+        self.callback(message, timestamp)
+
+    def close(self):
+        pass
+
+
+class VirtualPortSink:
+    def __init__(self, max_size: int = 0):
+        # Stand-in for an output port, another thread reads the messages and their timestamps from the queue
+        self.messages: queue.Queue = queue.Queue(max_size)
+
+    def send(self, message: bytes, timestamp: float):
+        self.messages.put_nowait((timestamp, message))
+
+    def close(self):
+        self.messages.put(None)
+
+    def __iter__(self) -> Iterator[Tuple[float, bytes]]:
+        item = self.messages.get()
+        while item is not None:
+            yield item
+            item = self.messages.get()
+
+
+class LatencyStats:
+    def __init__(self):
+        # Lateness of every message in seconds, from the time it was due until it was handed to the sink
+        self.latencies = array('d')
+
+    def add(self, latency: float):
+        self.latencies.append(latency)
+
+    def summary(self) -> Dict[str, float]:
+        count = len(self.latencies)
+        if not count:
+            return {"events": 0}
+        ordered = sorted(self.latencies)
+        mean = sum(ordered) / count
+        return {
+            "events": count,
+            "mean": mean,
+            "p99": ordered[min(count - 1, math.ceil(count * 0.99) - 1)],
+            "max": ordered[-1],
+            # Standard deviation of the latency, a constant delay is not heard but its variations are
+            "jitter": math.sqrt(sum((latency - mean) ** 2 for latency in ordered) / count),
+        }
+
+    def report(self) -> str:
+        summary = self.summary()
+        if not summary["events"]:
+            return "No events"
+        return "{} events, latency mean {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms, jitter {:.3f} ms".format(
+            summary["events"], summary["mean"] * 1000, summary["p99"] * 1000, summary["max"] * 1000,
+            summary["jitter"] * 1000)
+
+
+class Player:
+    def __init__(self, sink, tempo: float = DEFAULT_TEMPO, division: int = DEFAULT_DIVISION,
+                 spin: float = SPIN_TIME, clock: Callable[[], float] = time.perf_counter):
+        self.sink = sink
+        self.tempo = tempo
+        self.division = division
+        self.spin = spin
+        # Must be monotonic, perf_counter is the one with the finest resolution
+        self.clock = clock
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def wait(self, deadline: float):
+        remaining = deadline - self.clock()
+        if remaining > self.spin:
+            # Wakes up early when stopped
+            self.stopped.wait(remaining - self.spin)
+        while self.clock() < deadline and not self.stopped.is_set():
+            pass
+
+    def play(self, notes: Iterable[Tuple[int, int]]) -> LatencyStats:
+        # The notes are pulled from the iterable as they are played, a lazily generated riff starts right away
+        stats = LatencyStats()
+        seconds_per_tick = 60 / (self.tempo * self.division)
+        playing = set()
+        start = self.clock() + LEAD_TIME
+        try:
+            for tick, message in iter_timed_events(notes):
+                # Computed from the start instead of accumulated, so rounding errors do not drift
+                deadline = start + tick * seconds_per_tick
+                self.wait(deadline)
+                if self.stopped.is_set():
+                    break
+                self.sink.send(message, deadline)
+                stats.add(self.clock() - deadline)
+                if message[2]:
+                    playing.add(message[1])
+                else:
+                    playing.discard(message[1])
+        finally:
+            for pitch in playing:
+                self.sink.send(note_off(pitch), self.clock())
+            if self.stopped.is_set():
+                self.sink.send(ALL_NOTES_OFF, self.clock())
+        return stats
+
+    def play_riff(self, riff: Riff) -> LatencyStats:
+        return self.play(riff.iter_notes())
+
+
+def print_message(message: bytes, timestamp: float):
+    print("{:12.6f} {}".format(timestamp, message.hex(" ")))
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Play a random riff as timed MIDI messages")
+    add_riff_arguments(parser)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--tempo", type=float, default=DEFAULT_TEMPO, help="quarter notes per minute")
+    parser.add_argument("-o", "--output", default="-",
+                        help="file or device the raw MIDI messages are written to, - for the standard output "
+                             "(default)")
+    parser.add_argument("--print", action="store_true", help="print the messages and their time instead")
+    args = parser.parse_args(argv)
+    if args.tempo <= 0:
+        parser.error("the tempo must be positive")
+
+    riff = Riff(**check_riff_options(parser, args), seed=args.seed)
+    output = None
+    if args.print:
+        sink = CallbackSink(print_message)
+    elif args.output == "-":
+        sink = PipeSink(sys.stdout.buffer)
+    else:
+        output = open(args.output, "wb", buffering=0)
+        sink = PipeSink(output)
+    try:
+        stats = Player(sink, args.tempo, riff.division).play_riff(riff)
+    except KeyboardInterrupt:
+        # The notes still playing have been released by the player
+        return
+    finally:
+        sink.close()
+        if output is not None:
+            output.close()
+    print(stats.report(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Sequence, Tuple, Iterator, TYPE_CHECKING
+
+from midi import Interval, INTERVAL_SEMITONES, NoteArray, RandomSource, import_numpy
+
+if TYPE_CHECKING:
+    import numpy
+
+SEMITONE_INTERVALS = {semitones: interval for interval, semitones in INTERVAL_SEMITONES.items()}
+
+# Weight of the interval between two consecutive notes, steps are favoured over leaps and dissonant intervals are rare
+DEFAULT_INTERVAL_WEIGHTS = {
+    Interval.UNISON: 2, Interval.MINOR_SECOND: 3, Interval.MAJOR_SECOND: 4, Interval.MINOR_THIRD: 3,
+    Interval.MAJOR_THIRD: 3, Interval.PERFECT_FOURTH: 2, Interval.DIMINISHED_FIFTH: 0.5, Interval.PERFECT_FIFTH: 2,
+    Interval.MINOR_SIXTH: 1, Interval.MAJOR_SIXTH: 1, Interval.MINOR_SEVENTH: 0.5, Interval.MAJOR_SEVENTH: 0.5,
+    Interval.OCTAVE: 1
+}
+# Weight of keeping the same note length relative to switching to any other allowed length
+DEFAULT_RHYTHM_REPEAT = 3
+# Transition tables kept for reuse. Enough for every scale on every root with one set of weights, while a long running
+# server drawing riffs for any combination of rhythms and divisions cannot grow the caches without bound.
+PITCH_TABLE_CACHE_SIZE = 64
+RHYTHM_TABLE_CACHE_SIZE = 32
+
+
+class AliasTable:
+    __slots__ = ('probabilities', 'aliases')
+
+    def __init__(self, weights: Sequence[float]):
+        # Vose's alias method: each of the n columns holds a probability of keeping its own index and an alias taken
+        # otherwise, so a weighted draw only needs a single uniform number whatever the weights
+        count = len(weights)
+        total = sum(weights)
+        if not count or total <= 0 or min(weights) < 0:
+            raise ValueError("Invalid weights {}".format(list(weights)))
+        scaled = [weight * count / total for weight in weights]
+        self.probabilities = [1.0] * count
+        self.aliases = list(range(count))
+        small = [index for index, probability in enumerate(scaled) if probability < 1]
+        large = [index for index, probability in enumerate(scaled) if probability >= 1]
+        while small and large:
+            low = small.pop()
+            high = large.pop()
+            self.probabilities[low] = scaled[low]
+            self.aliases[low] = high
+            scaled[high] -= 1 - scaled[low]
+            (small if scaled[high] < 1 else large).append(high)
+        # Whatever is left has a probability of 1 up to rounding errors
+
+    def draw(self, rng: RandomSource) -> int:
+        column = rng.random() * len(self.probabilities)
+        index = int(column)
+        return index if column - index < self.probabilities[index] else self.aliases[index]
+
+
+class TransitionTable:
+    __slots__ = ('states', 'initial', 'rows', '_arrays')
+
+    def __init__(self, states: Sequence[int], transitions: Sequence[Sequence[float]],
+                 initial: Sequence[float] = None):
+        self.states = tuple(states)
+        self.initial = AliasTable(initial or [1] * len(self.states))
+        self.rows = tuple(AliasTable(row) for row in transitions)
+        self._arrays = None
+
+    def walk(self, rng: RandomSource) -> Iterator[int]:
+        states = self.states
+        rows = self.rows
+        index = self.initial.draw(rng)
+        while True:
+            yield states[index]
+            index = rows[index].draw(rng)
+
+    def arrays(self) -> Tuple['numpy.ndarray', ...]:
+        if self._arrays is None:
+            numpy = import_numpy()
+            self._arrays = (numpy.asarray(self.states), numpy.array(self.initial.probabilities),
+                            numpy.array(self.initial.aliases),
+                            numpy.array([row.probabilities for row in self.rows]),
+                            numpy.array([row.aliases for row in self.rows]))
+        return self._arrays
+
+    def walk_many(self, shape: Tuple[int, int], generator: 'numpy.random.Generator') -> 'numpy.ndarray':
+        # Walks as many chains as rows at once, one step for all of them at a time
+        numpy = import_numpy()
+        states, initial_probabilities, initial_aliases, probabilities, aliases = self.arrays()
+        chains, steps = shape
+        count = len(self.states)
+        indices = numpy.empty((steps, chains), dtype=numpy.intp)
+        columns = generator.random((steps, chains)) * count
+        selected = columns.astype(numpy.intp)
+        kept = columns - selected
+        if steps:
+            indices[0] = numpy.where(kept[0] < initial_probabilities[selected[0]], selected[0],
+                                     initial_aliases[selected[0]])
+        for step in range(1, steps):
+            previous = indices[step - 1]
+            column = selected[step]
+            indices[step] = numpy.where(kept[step] < probabilities[previous, column], column,
+                                        aliases[previous, column])
+        return states[numpy.ascontiguousarray(indices.T)]
+
+
+@lru_cache(maxsize=PITCH_TABLE_CACHE_SIZE)
+def pitch_table(allowed_notes: Tuple[int, ...], semitone_weights: Tuple[float, ...]) -> TransitionTable:
+    # Computed once per set of allowed notes and weights, that is once per scale and root with the default model
+    transitions = []
+    for pitch in allowed_notes:
+        row = [semitone_weights[abs(next_pitch - pitch)] if abs(next_pitch - pitch) < len(semitone_weights) else 0
+               for next_pitch in allowed_notes]
+        transitions.append(row if sum(row) > 0 else [1] * len(allowed_notes))
+    return TransitionTable(allowed_notes, transitions)
+
+
+@lru_cache(maxsize=RHYTHM_TABLE_CACHE_SIZE)
+def rhythm_table(rhythm_ticks: Tuple[int, ...], repeat: float) -> TransitionTable:
+    transitions = [[repeat if row == column else 1 for column in range(len(rhythm_ticks))]
+                   for row in range(len(rhythm_ticks))]
+    return TransitionTable(rhythm_ticks, transitions)
+
+
+class MarkovModel:
+    __slots__ = ('semitone_weights', 'rhythm_repeat')
+
+    def __init__(self, interval_weights: Dict[Interval, float] = None, rhythm_repeat: float = DEFAULT_RHYTHM_REPEAT):
+        interval_weights = DEFAULT_INTERVAL_WEIGHTS if interval_weights is None else interval_weights
+        self.semitone_weights: Tuple[float, ...] = tuple(interval_weights.get(SEMITONE_INTERVALS[semitones], 0)
+                                                         for semitones in range(len(SEMITONE_INTERVALS)))
+        self.rhythm_repeat = rhythm_repeat
+
+    def tables(self, allowed_notes: Tuple[int, ...],
+               rhythm_ticks: Sequence[int]) -> Tuple[TransitionTable, TransitionTable]:
+        return pitch_table(tuple(allowed_notes), self.semitone_weights), \
+            rhythm_table(tuple(rhythm_ticks), self.rhythm_repeat)
+
+    def iter_pitches(self, allowed_notes: Tuple[int, ...], rng: RandomSource) -> Iterator[int]:
+        return pitch_table(tuple(allowed_notes), self.semitone_weights).walk(rng)
+
+    def iter_notes(self, allowed_notes: Tuple[int, ...], rhythm_ticks: Sequence[int], count: int,
+                   rng: RandomSource) -> Iterator[Tuple[int, int]]:
+        pitches, lengths = self.tables(allowed_notes, rhythm_ticks)
+        return islice(zip(pitches.walk(rng), lengths.walk(rng)), count)
+
+    def draw(self, allowed_notes: Tuple[int, ...], rhythm_ticks: Sequence[int], count: int,
+             rng: RandomSource) -> NoteArray:
+        notes = NoteArray()
+        for pitch, length in self.iter_notes(allowed_notes, rhythm_ticks, count, rng):
+            notes.append(pitch, length)
+        return notes
+
+    def draw_many(self, allowed_notes: Tuple[int, ...], rhythm_ticks: Sequence[int], shape: Tuple[int, int],
+                  generator: 'numpy.random.Generator') -> Tuple['numpy.ndarray', 'numpy.ndarray']:
+        numpy = import_numpy()
+        pitches, lengths = self.tables(allowed_notes, rhythm_ticks)
+        return pitches.walk_many(shape, generator).astype(numpy.uint8), \
+            lengths.walk_many(shape, generator).astype(numpy.uint32)
+
+    def __repr__(self) -> str:
+        return "MarkovModel(semitone_weights={}, rhythm_repeat={})".format(self.semitone_weights, self.rhythm_repeat)
@@ -1,6 +1,22 @@
+import copy
+import math
 import random
+import struct
+import sys
+from array import array
+from collections import Counter
 from enum import IntEnum, Enum, auto
-from typing import List, Union, Tuple, BinaryIO
+from functools import lru_cache
+from itertools import islice
+from time import perf_counter
+from typing import List, Union, Tuple, BinaryIO, Iterable, Iterator, Sequence, TYPE_CHECKING
+
+from rhythm import DEFAULT_BEATS_PER_BAR, iter_rhythm
+
+if TYPE_CHECKING:
+    # Only for the annotations, numpy is imported on first use by import_numpy and markov imports this module
+    import numpy
+    import markov
 
 
 class MIDIWritingError(Exception):
@@ -8,14 +24,68 @@ class MIDIWritingError(Exception):
         super().__init__(message)
 
 
+class MIDIReadingError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+# Ticks per quarter note
+DEFAULT_DIVISION = 480
+
+# Stage metrics, set by instrumentation.enable. Left to None, each instrumented stage only costs a check of this global
+metrics = None
+
+
 class NoteLength(IntEnum):
-    WHOLE = 0x8f00
-    HALF = 0x8740
-    QUARTER = 0x8360
-    EIGHTH = 0x8170
-    SIXTEENTH = 0x7880
-    TH32 = 0x3C80
-    TH64 = 0x1E80
+    # Length in sixty-fourth notes
+    WHOLE = 64
+    HALF = 32
+    QUARTER = 16
+    EIGHTH = 8
+    SIXTEENTH = 4
+    TH32 = 2
+    TH64 = 1
+
+    def ticks(self, division: int = DEFAULT_DIVISION) -> int:
+        return self.value * division // NoteLength.QUARTER
+
+
+def note_ticks(length: Union[NoteLength, int], division: int = DEFAULT_DIVISION) -> int:
+    # Note lengths are converted to ticks, plain integers already are a number of ticks
+    return length.ticks(division) if isinstance(length, NoteLength) else int(length)
+
+
+def rhythm_to_ticks(rhythm: Iterable[Union[NoteLength, int]], division: int = DEFAULT_DIVISION) -> Tuple[int, ...]:
+    # Note lengths compare and hash equal to their values, the types keep NoteLength.QUARTER apart from 16 ticks
+    rhythm = tuple(rhythm)
+    return cached_rhythm_ticks(rhythm, tuple(map(type, rhythm)), division)
+
+
+@lru_cache(maxsize=256)
+def cached_rhythm_ticks(rhythm: Tuple[Union[NoteLength, int], ...], types: Tuple[type, ...],
+                        division: int) -> Tuple[int, ...]:
+    # A note length that does not last a whole number of ticks would be silently shortened
+    if not 0 < division < 0x8000:
+        raise ValueError("Invalid division of {} ticks per quarter note".format(division))
+    ticks = []
+    for length in rhythm:
+        if isinstance(length, NoteLength) and length.value * division % NoteLength.QUARTER:
+            multiple = NoteLength.QUARTER // math.gcd(length.value, NoteLength.QUARTER)
+            raise ValueError("A {} note does not last a whole number of ticks at a division of {}, use a multiple of "
+                             "{}".format(length.name, division, multiple))
+        value = note_ticks(length, division)
+        if value <= 0:
+            raise ValueError("Note lengths must last at least one tick, got {}".format(value))
+        ticks.append(value)
+    return tuple(ticks)
+
+
+def dotted(length: NoteLength, division: int = DEFAULT_DIVISION) -> int:
+    return length.ticks(division) * 3 // 2
+
+
+def tuplet(length: NoteLength, notes: int = 3, space: int = 2, division: int = DEFAULT_DIVISION) -> int:
+    return length.ticks(division) * space // notes
 
 
 class NoteValue(IntEnum):
@@ -64,141 +134,582 @@ class Scale(Enum):
                               Interval.MAJOR_SIXTH]
 
 
+INTERVAL_SEMITONES = {
+    Interval.UNISON: 0, Interval.MINOR_SECOND: 1, Interval.MAJOR_SECOND: 2, Interval.MINOR_THIRD: 3,
+    Interval.MAJOR_THIRD: 4, Interval.PERFECT_FOURTH: 5, Interval.DIMINISHED_FIFTH: 6, Interval.PERFECT_FIFTH: 7,
+    Interval.MINOR_SIXTH: 8, Interval.MAJOR_SIXTH: 9, Interval.MINOR_SEVENTH: 10, Interval.MAJOR_SEVENTH: 11,
+    Interval.OCTAVE: 12
+}
+
+
 class Note:
+    __slots__ = ('value',)
+
     def __init__(self, note: NoteValue):
         self.value = note
 
     def get_minor_second(self) -> int:
-        return self.value + 1
+        return self.get_relative_note(Interval.MINOR_SECOND)
 
     def get_major_second(self) -> int:
-        return self.value + 2
+        return self.get_relative_note(Interval.MAJOR_SECOND)
 
     def get_minor_third(self) -> int:
-        return self.value + 3
+        return self.get_relative_note(Interval.MINOR_THIRD)
 
     def get_major_third(self) -> int:
-        return self.value + 4
+        return self.get_relative_note(Interval.MAJOR_THIRD)
 
     def get_perfect_fourth(self) -> int:
-        return self.value + 5
+        return self.get_relative_note(Interval.PERFECT_FOURTH)
 
     def get_diminished_fifth(self) -> int:
-        return self.value + 6
+        return self.get_relative_note(Interval.DIMINISHED_FIFTH)
 
     def get_augmented_fourth(self) -> int:
         return self.get_diminished_fifth()
 
     def get_perfect_fifth(self) -> int:
-        return self.value + 7
+        return self.get_relative_note(Interval.PERFECT_FIFTH)
 
     def get_minor_sixth(self) -> int:
-        return self.value + 8
+        return self.get_relative_note(Interval.MINOR_SIXTH)
 
     def get_major_sixth(self) -> int:
-        return self.value + 9
+        return self.get_relative_note(Interval.MAJOR_SIXTH)
 
     def get_minor_seventh(self) -> int:
-        return self.value + 10
+        return self.get_relative_note(Interval.MINOR_SEVENTH)
 
     def get_major_seventh(self) -> int:
-        return self.value + 11
+        return self.get_relative_note(Interval.MAJOR_SEVENTH)
 
     def get_perfect_octave(self) -> int:
-        return self.value + 12
+        return self.get_relative_note(Interval.OCTAVE)
 
     def get_relative_note(self, interval: Interval) -> int:
-        if interval == Interval.MINOR_SECOND:
-            return self.get_minor_second()
-        elif interval == Interval.MAJOR_SECOND:
-            return self.get_major_second()
-        elif interval == Interval.MINOR_THIRD:
-            return self.get_minor_third()
-        elif interval == Interval.MAJOR_THIRD:
-            return self.get_major_third()
-        elif interval == Interval.PERFECT_FOURTH:
-            return self.get_perfect_fourth()
-        elif interval == Interval.AUGMENTED_FOURTH:
-            return self.get_augmented_fourth()
-        elif interval == Interval.PERFECT_FIFTH:
-            return self.get_perfect_fifth()
-        elif interval == Interval.MINOR_SIXTH:
-            return self.get_minor_sixth()
-        elif interval == Interval.MAJOR_SIXTH:
-            return self.get_major_sixth()
-        elif interval == Interval.MINOR_SEVENTH:
-            return self.get_minor_seventh()
-        elif interval == Interval.MAJOR_SEVENTH:
-            return self.get_major_seventh()
-        elif interval == Interval.OCTAVE:
-            return self.get_perfect_octave()
-        elif interval == Interval.UNISON:
-            return self.value.value
+        return int(self.value) + INTERVAL_SEMITONES[interval]
 
 
-class Riff:
-    def __init__(self, scale: Scale = None, root: NoteValue = None, number_notes: int = None,
-                 allowed_rhythm: List[NoteLength] = None):
+CHROMATIC_NOTES: Tuple[int, ...] = tuple(note.value for note in NoteValue)
+ALL_NOTE_LENGTHS: Tuple[NoteLength, ...] = tuple(NoteLength)
+# Pitch of the rests stored in a NoteArray, outside of the range of the MIDI notes
+REST = 0xff
+# Pitches of every scale built on every root
+SCALE_NOTES = {(root, scale): tuple(Note(root).get_relative_note(interval) for interval in scale.value)
+               for root in NoteValue for scale in Scale}
 
-        self.number_notes = random.randint(1, 16) if not number_notes else number_notes
 
-        if not scale or not root:
-            self.allowed_notes: List[int] = [note.value for note in NoteValue]
-        else:
-            note = Note(root)
-            self.allowed_notes: List[int] = [note.get_relative_note(interval) for interval in scale.value]
+class NoteArray:
+    __slots__ = ('pitches', 'lengths')
 
-        self.rhythm_allowed: List[NoteLength] = [value for value in NoteLength] if not allowed_rhythm else \
-            allowed_rhythm
-        self.notes: Union[List[Tuple[int, int]], None] = None
+    def __init__(self, pitches: Union[array, 'numpy.ndarray'] = None, lengths: Union[array, 'numpy.ndarray'] = None):
+        self.pitches = array('B') if pitches is None else pitches
+        self.lengths = array('I') if lengths is None else lengths
 
-    def populate(self):
-        self.notes = [(random.choice(self.allowed_notes), random.choice(self.rhythm_allowed))
-                      for x in range(self.number_notes)]
+    @classmethod
+    def from_notes(cls, notes: Iterable[Tuple[int, int]]) -> 'NoteArray':
+        note_array = cls()
+        for pitch, length in notes:
+            note_array.append(pitch, length)
+        return note_array
 
-    def size(self) -> int:
-        return len(self.notes) * 8
+    def append(self, pitch: int, length: int):
+        self.pitches.append(pitch)
+        self.lengths.append(length)
 
+    def __len__(self) -> int:
+        return len(self.pitches)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Tuple[int, int], 'NoteArray']:
+        if isinstance(index, slice):
+            return NoteArray(self.pitches[index], self.lengths[index])
+        return int(self.pitches[index]), int(self.lengths[index])
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return zip(self.pitches.tolist(), self.lengths.tolist())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, NoteArray):
+            return NotImplemented
+        return self.pitches.tolist() == other.pitches.tolist() and self.lengths.tolist() == other.lengths.tolist()
+
+    def __repr__(self) -> str:
+        return "NoteArray({})".format(list(self))
 
-def write(riff: Riff, file: BinaryIO):
-    write_mthd(file)
-    write_mtrk(riff, file)
-    # write_useless_mtrk(file)
 
+RandomSource = Union[random.Random, 'numpy.random.Generator']
 
-def write_mthd(file: BinaryIO):
-    res = file.write(bytes([0x4d, 0x54, 0x68, 0x64, 0x00, 0x00, 0x00, 0x06, 0x00, 0x01, 0x00, 0x01, 0x01, 0xe0]))
-    if res != 14:
-        raise MIDIWritingError("Error when writing MTHD chunk! Wrote {} bytes instead of 14".format(res))
 
+def import_numpy():
+    # numpy is optional and slow to import, it is only loaded once a vectorized mode is used
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("numpy is required for vectorized note generation")
+    return numpy
 
-def write_mtrk(riff: Riff, file: BinaryIO):
-    # MTRK identifier
-    written = file.write(bytes([0x4d, 0x54, 0x72, 0x6b]))
-    if written != 4:
-        raise MIDIWritingError("Error when writing MTRK identifier! Wrote {} bytes instead of 4".format(written))
 
-    # Size of the riff
-    written = file.write(riff.size().to_bytes(4, 'big'))
-    if written != 4:
-        raise MIDIWritingError("Error when writing MTRK data size! Wrote {} bytes instead of 4".format(written))
+def is_numpy_generator(rng) -> bool:
+    # A numpy generator cannot exist unless numpy has already been imported
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(rng, numpy.random.Generator)
+
+
+def derive_seed(seed: int, index: int) -> int:
+    # Independent child seed, so that any item of a batch can be regenerated on its own
+    import hashlib
+    digest = hashlib.blake2b("{}:{}".format(seed, index).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class Riff:
+    __slots__ = ('number_notes', 'allowed_notes', 'rhythm_allowed', 'rhythm_ticks', 'division', 'rng', 'model',
+                 'total_ticks', '_notes')
+
+    def __init__(self, scale: Scale = None, root: NoteValue = None, number_notes: int = None,
+                 allowed_rhythm: List[Union[NoteLength, int]] = None, seed: int = None, rng: RandomSource = None,
+                 division: int = DEFAULT_DIVISION, model: 'markov.MarkovModel' = None, bars: int = None,
+                 beats_per_bar: int = DEFAULT_BEATS_PER_BAR):
+        if metrics is not None:
+            start = perf_counter()
+
+        if rng is None:
+            # Without a seed or a generator, the module level random state is used
+            rng = random.Random(seed) if seed is not None else random
+        self.rng = rng
+
+        if number_notes:
+            self.number_notes = number_notes
+        elif is_numpy_generator(rng):
+            self.number_notes = int(rng.integers(1, 17))
+        else:
+            self.number_notes = rng.randint(1, 16)
+
+        if not scale or not root:
+            self.allowed_notes: Tuple[int, ...] = CHROMATIC_NOTES
+        else:
+            self.allowed_notes: Tuple[int, ...] = SCALE_NOTES[root, scale]
+
+        self.rhythm_allowed: Sequence[Union[NoteLength, int]] = ALL_NOTE_LENGTHS if not allowed_rhythm else \
+            allowed_rhythm
+        self.division = division
+        self.rhythm_ticks: Tuple[int, ...] = rhythm_to_ticks(self.rhythm_allowed, division)
+        # Draws each note from the previous one instead of independently when set
+        self.model = model
+        # When set, the note lengths add up to exactly that many ticks and the number of notes follows from them
+        if bars is not None and (bars <= 0 or beats_per_bar <= 0):
+            raise ValueError("Cannot fill {} bars of {} beats".format(bars, beats_per_bar))
+        self.total_ticks = bars * beats_per_bar * division if bars else None
+        self.notes = None
+
+        if metrics is not None:
+            metrics.record("init", perf_counter() - start)
+
+    @property
+    def notes(self) -> Union[NoteArray, None]:
+        return self._notes
+
+    @notes.setter
+    def notes(self, notes: Union[NoteArray, Iterable[Tuple[int, int]], None]):
+        if notes is None or isinstance(notes, NoteArray):
+            self._notes = notes
+        else:
+            # A NoteLength is a number of sixty-fourth notes, stored lengths are ticks at the division of the riff
+            self._notes = NoteArray.from_notes((pitch, note_ticks(length, self.division)) for pitch, length in notes)
+
+    def numpy_generator(self) -> 'numpy.random.Generator':
+        if is_numpy_generator(self.rng):
+            return self.rng
+        return import_numpy().random.default_rng(self.rng.getrandbits(64))
+
+    def populate(self, vectorized: bool = False, generator: 'numpy.random.Generator' = None):
+        if metrics is not None:
+            start = perf_counter()
+        if self.total_ticks:
+            self.notes = NoteArray.from_notes(self.iter_bar_notes(generator if generator is not None else self.rng))
+            self.number_notes = len(self.notes)
+        elif self.model is not None:
+            rng = generator if generator is not None else self.rng
+            self.notes = self.model.draw(self.allowed_notes, self.rhythm_ticks, self.number_notes, rng)
+        elif vectorized or generator is not None or is_numpy_generator(self.rng):
+            generator = generator if generator is not None else self.numpy_generator()
+            # Drawn in the same blocks as iter_notes, so that a generator gives the same notes to both
+            blocks = []
+            for offset in range(0, self.number_notes, STREAM_CHUNK_NOTES):
+                count = min(STREAM_CHUNK_NOTES, self.number_notes - offset)
+                blocks.append(draw_notes(self.allowed_notes, self.rhythm_ticks, count, generator))
+            if len(blocks) == 1:
+                self.notes = NoteArray(*blocks[0])
+            else:
+                numpy = import_numpy()
+                self.notes = NoteArray(numpy.concatenate([pitches for pitches, _ in blocks]),
+                                       numpy.concatenate([lengths for _, lengths in blocks]))
+        else:
+            choice = self.rng.choice
+            allowed_notes = self.allowed_notes
+            rhythm_ticks = self.rhythm_ticks
+            notes = NoteArray()
+            for x in range(self.number_notes):
+                notes.append(choice(allowed_notes), choice(rhythm_ticks))
+            self.notes = notes
+        if metrics is not None:
+            metrics.record("populate", perf_counter() - start, self.number_notes)
+
+    def iter_notes(self) -> Iterator[Tuple[int, int]]:
+        if self.total_ticks:
+            yield from self.iter_bar_notes(self.rng)
+            return
+        if self.model is not None:
+            yield from self.model.iter_notes(self.allowed_notes, self.rhythm_ticks, self.number_notes, self.rng)
+            return
+        if is_numpy_generator(self.rng):
+            for start in range(0, self.number_notes, STREAM_CHUNK_NOTES):
+                count = min(STREAM_CHUNK_NOTES, self.number_notes - start)
+                yield from NoteArray(*draw_notes(self.allowed_notes, self.rhythm_ticks, count, self.rng))
+            return
+
+        choice = self.rng.choice
+        allowed_notes = self.allowed_notes
+        rhythm_ticks = self.rhythm_ticks
+        for x in range(self.number_notes):
+            yield choice(allowed_notes), choice(rhythm_ticks)
+
+    def iter_bar_notes(self, rng: RandomSource) -> Iterator[Tuple[int, int]]:
+        lengths = iter_rhythm(self.rhythm_ticks, self.total_ticks, rng)
+        if self.model is not None:
+            yield from zip(self.model.iter_pitches(self.allowed_notes, rng), lengths)
+            return
+        allowed_notes = self.allowed_notes
+        if is_numpy_generator(rng):
+            for length in lengths:
+                yield allowed_notes[rng.integers(len(allowed_notes))], length
+            return
+        choice = rng.choice
+        for length in lengths:
+            yield choice(allowed_notes), length
+
+    def populate_many(self, count: int, generator: 'numpy.random.Generator' = None) -> List['Riff']:
+        if metrics is not None:
+            start = perf_counter()
+        generator = generator if generator is not None else self.numpy_generator()
+        if self.total_ticks:
+            # Riffs filling the same bars hold different numbers of notes, they cannot be drawn as one block
+            riffs = []
+            for _ in range(count):
+                riff = copy.copy(self)
+                riff.notes = NoteArray.from_notes(self.iter_bar_notes(generator))
+                riff.number_notes = len(riff.notes)
+                riffs.append(riff)
+            if metrics is not None:
+                metrics.record("populate", perf_counter() - start, sum(len(riff.notes) for riff in riffs))
+            return riffs
+        if self.model is not None:
+            pitches, lengths = self.model.draw_many(self.allowed_notes, self.rhythm_ticks, (count, self.number_notes),
+                                                    generator)
+        else:
+            pitches, lengths = draw_notes(self.allowed_notes, self.rhythm_ticks, (count, self.number_notes),
+                                          generator)
+        riffs = []
+        for row in range(count):
+            riff = copy.copy(self)
+            riff.notes = NoteArray(pitches[row], lengths[row])
+            riffs.append(riff)
+        if metrics is not None:
+            metrics.record("populate", perf_counter() - start, count * self.number_notes)
+        return riffs
+
+    def size(self, compact: bool = False) -> int:
+        return track_size(self.notes, compact)
+
+
+def draw_notes(allowed_notes: Tuple[int, ...], rhythm_ticks: Sequence[int], shape: Union[int, Tuple[int, ...]],
+               generator: 'numpy.random.Generator' = None) -> Tuple['numpy.ndarray', 'numpy.ndarray']:
+    numpy = import_numpy()
+    generator = generator if generator is not None else numpy.random.default_rng()
+    pitches = numpy.asarray(allowed_notes, dtype=numpy.uint8)
+    lengths = numpy.asarray(rhythm_ticks, dtype=numpy.uint32)
+    return pitches[generator.integers(0, len(pitches), size=shape)], \
+        lengths[generator.integers(0, len(lengths), size=shape)]
+
+
+# MTHD identifier, size of the header data, format, number of tracks and division
+MTHD_HEADER = struct.Struct('>4sIHHH')
+# Delta of the end of track event, which is one tick after the last note is released
+END_OF_TRACK = bytes([0x01, 0xff, 0x2f, 0x00])
+END_OF_TRACK_META = END_OF_TRACK[1:]
+
+# MTRK identifier followed by the size of the track data
+CHUNK_HEADER = struct.Struct('>4sI')
+
+MAX_CHUNK_SIZE = 0xffffffff
+MAX_VLQ = 0x0fffffff
+# Note on, with a delta, status and velocity, then the note length as a delta and the release with a null velocity
+MAX_NOTE_EVENT_SIZE = 4 + 4 + 2
+MAX_NOTES = (MAX_CHUNK_SIZE - len(END_OF_TRACK)) // MAX_NOTE_EVENT_SIZE
+
+# Number of notes encoded at once by the streaming writer
+STREAM_CHUNK_NOTES = 4096
+# Size above which the track data of a non seekable output is spooled to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+def encode_mthd(division: int = DEFAULT_DIVISION, tracks: int = 1) -> bytes:
+    if not 0 < division < 0x8000:
+        raise MIDIWritingError("Invalid division of {} ticks per quarter note".format(division))
+    return MTHD_HEADER.pack(b'MThd', 6, 1, tracks, division)
+
+
+MTHD = encode_mthd()
+
+
+def encode_vlq(value: int) -> bytes:
+    if value < 0x80:
+        return bytes((value,))
+    if value > MAX_VLQ:
+        raise MIDIWritingError("Delta of {} ticks is too long to be encoded".format(value))
+    encoded = [value & 0x7f]
+    value >>= 7
+    while value:
+        encoded.append(0x80 | (value & 0x7f))
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+class VLQTable(dict):
+    def __missing__(self, value: int) -> bytes:
+        encoded = self[value] = encode_vlq(value)
+        return encoded
+
+
+COMMON_TICKS = [length.ticks(division) for length in NoteLength for division in (96, 192, 384, 480, 960)]
+VLQ = VLQTable((value, encode_vlq(value)) for value in list(range(0x80)) + COMMON_TICKS)
+
+NOTE_ON_STATUS = b'\x90'
+NOTE_ON = [bytes([0x90, pitch, 0x40]) for pitch in range(0x80)]
+# Note on relying on the running status of a previous note
+RUNNING_NOTE_ON = [bytes([pitch, 0x40]) for pitch in range(0x80)]
+NOTE_RELEASE = [bytes([pitch, 0x00]) for pitch in range(0x80)]
+
+# Delta, note on, velocity, padded note length and release, followed by the offsets of the pitch, of the note length
+# and of the released pitch, which are filled in from the note buffers
+NOTE_LAYOUT = (bytes([0x00, 0x90, 0x00, 0x40, 0x80, 0x00, 0x00, 0x00]), 2, 4, 6)
+# Same without the note on status byte
+RUNNING_NOTE_LAYOUT = (bytes([0x00, 0x00, 0x40, 0x80, 0x00, 0x00, 0x00]), 1, 3, 5)
+VLQ_PADDING = b'\x80'
+DATA_BYTES = bytes(range(0x80))
+# Bytes of the high byte of the note lengths that fit in at most two variable length quantity bytes
+SHORT_LENGTH_HIGH_BYTES = bytes(range(0x40))
+# Translation tables computing the variable length quantity of a note length from its two low bytes
+LEADING_BITS_OF_HIGH_BYTE = bytes(0x80 | (value << 1) & 0xff for value in range(0x100))
+LEADING_BIT_OF_LOW_BYTE = bytes(value >> 7 for value in range(0x100))
+TRAILING_BITS_OF_LOW_BYTE = bytes(value & 0x7f for value in range(0x100))
+
+
+def length_bytes(notes: NoteArray) -> List[bytes]:
+    # Note lengths split by byte, from the least significant one
+    width = notes.lengths.itemsize
+    data = bytes(memoryview(notes.lengths).cast('B'))
+    planes = [data[index::width] for index in range(width)]
+    return planes if sys.byteorder == 'little' else planes[::-1]
+
+
+def encode_notes(notes: NoteArray, rest: int = 0, compact: bool = False,
+                 running_status: bool = False) -> Tuple[Union[bytes, bytearray], int]:
+    # Returns the encoded notes and the length of the rest that follows them. In compact mode, only the first note on
+    # carries its status byte, or none of them when the note on status is already running from previous notes.
+    count = len(notes)
+    if not count:
+        return b'', rest
+    pitches = bytes(memoryview(notes.pitches).cast('B'))
+    low, high, *upper = length_bytes(notes)
+    if rest or pitches.translate(None, DATA_BYTES) or high.translate(None, SHORT_LENGTH_HIGH_BYTES) or \
+            any(byte.translate(None, b'\x00') for byte in upper):
+        return encode_events(pitches, notes.lengths.tolist(), rest, compact, running_status)
+
+    # Fast path for notes below 0x4000 ticks without rests, every note is encoded with a two byte note length and the
+    # padding of the single byte note lengths is removed afterwards. 0x80 is not found anywhere else in the track as
+    # pitches are below 0x80 and the leading byte of a two byte variable length quantity is at least 0x81. Both bytes
+    # of the note lengths are computed for every note at once with translation tables.
+    leading = int.from_bytes(high.translate(LEADING_BITS_OF_HIGH_BYTE), 'big') | \
+        int.from_bytes(low.translate(LEADING_BIT_OF_LOW_BYTE), 'big')
+    leading = leading.to_bytes(count, 'big')
+
+    template, pitch, length, release = RUNNING_NOTE_LAYOUT if compact else NOTE_LAYOUT
+    size = len(template)
+    end = count * size
+    buffer = bytearray(template * count)
+    buffer[pitch:end:size] = pitches
+    buffer[length:end:size] = leading
+    buffer[length + 1:end:size] = low.translate(TRAILING_BITS_OF_LOW_BYTE)
+    buffer[release:end:size] = pitches
+
+    if VLQ_PADDING in leading:
+        buffer = buffer.translate(None, VLQ_PADDING)
+    if compact and not running_status:
+        # Status of the first note on, right after its delta
+        buffer[1:1] = NOTE_ON_STATUS
+    return buffer, 0
+
+
+def encode_events(pitches: Iterable[int], lengths: Iterable[int], rest: int = 0, compact: bool = False,
+                  running_status: bool = False) -> Tuple[bytes, int]:
+    events = []
+    append = events.append
+    note_on = RUNNING_NOTE_ON if compact and running_status else NOTE_ON
+    try:
+        for pitch, ticks in zip(pitches, lengths):
+            if pitch == REST:
+                rest += ticks
+                continue
+            append(VLQ[rest])
+            append(note_on[pitch])
+            append(VLQ[ticks])
+            append(NOTE_RELEASE[pitch])
+            rest = 0
+            if compact:
+                note_on = RUNNING_NOTE_ON
+    except IndexError:
+        raise MIDIWritingError("Invalid pitch {}".format(pitch))
+    return b''.join(events), rest
+
+
+def encode_end_of_track(rest: int = 0) -> bytes:
+    return END_OF_TRACK if not rest else VLQ[rest + 1] + END_OF_TRACK_META
+
+
+def vlq_size(value: int) -> int:
+    return 1 if value < 0x80 else 2 if value < 0x4000 else 3 if value < 0x200000 else 4
+
+
+def track_size(notes: NoteArray, compact: bool = False) -> int:
+    # Size of the track data returned by encode_track, counted from the note buffers without encoding them
+    pitches = bytes(memoryview(notes.pitches).cast('B'))
+    lengths = notes.lengths.tolist()
+    rest = 0
+    if REST not in pitches:
+        # Null delta, note on, note length and release for every note, with as many note lengths of each size
+        played = len(pitches)
+        size = played * 6 + sum(vlq_size(ticks) * number for ticks, number in Counter(lengths).items())
+    else:
+        played = size = 0
+        for pitch, ticks in zip(pitches, lengths):
+            if pitch == REST:
+                rest += ticks
+                continue
+            size += vlq_size(rest) + 5 + vlq_size(ticks)
+            played += 1
+            rest = 0
+    if compact and played:
+        # Only the first note on carries its status byte
+        size -= played - 1
+    return size + len(encode_end_of_track(rest))
+
+
+def encode_track(notes: NoteArray, compact: bool = False) -> bytearray:
+    if metrics is not None:
+        start = perf_counter()
+    data, rest = encode_notes(notes, compact=compact)
+    track = bytearray(data)
+    track += encode_end_of_track(rest)
+    if metrics is not None:
+        metrics.record("encode", perf_counter() - start, len(notes), len(track))
+    return track
+
+
+def encode_mtrk(riff: Riff, compact: bool = False) -> bytearray:
+    track = encode_track(riff.notes, compact)
+    if len(track) > MAX_CHUNK_SIZE:
+        raise MIDIWritingError("Riff too long! A MTRK chunk can hold at most {} bytes".format(MAX_CHUNK_SIZE))
+    return CHUNK_HEADER.pack(b'MTrk', len(track)) + track
+
+
+def encode(riff: Riff, compact: bool = False) -> bytearray:
+    return encode_mthd(riff.division) + encode_mtrk(riff, compact)
+
+
+def write(riff: Riff, file: BinaryIO, compact: bool = False):
+    write_all(file, encode(riff, compact), "MIDI file")
+    # write_useless_mtrk(file)
+
 
-    for note in riff.notes:
-        written = file.write(bytes([0x00]))
-        written += file.write(bytes([0x90]))
-        written += file.write(bytes([note[0]]))
-        written += file.write(bytes([0x40]))
-        written += file.write(note[1].to_bytes(2, 'big'))
-        written += file.write(bytes([note[0]]))
-        written += file.write(bytes([0x00]))
-        if written != 8:
-            raise MIDIWritingError("Error on writing note {}. Wrote {} bytes instead of 8".format(bytes([note[0]]),
-                                                                                                  written))
+def write_all(file: BinaryIO, data: Union[bytes, bytearray, memoryview], what: str):
+    expected = len(data)
+    if metrics is not None:
+        start = perf_counter()
+        written = file.write(data)
+        metrics.record("write", perf_counter() - start, 0, written or 0)
+    else:
+        written = file.write(data)
+    if written != expected:
+        raise MIDIWritingError("Error when writing {}! Wrote {} bytes instead of {}".format(what, written, expected))
+
+
+def write_mthd(file: BinaryIO, division: int = DEFAULT_DIVISION):
+    write_all(file, encode_mthd(division), "MTHD chunk")
+
+
+def write_mtrk(riff: Riff, file: BinaryIO, compact: bool = False):
+    write_all(file, encode_mtrk(riff, compact), "MTRK chunk")
+
+
+def write_stream(notes: Iterable[Tuple[int, int]], file: BinaryIO, division: int = DEFAULT_DIVISION,
+                 chunk_notes: int = STREAM_CHUNK_NOTES, compact: bool = False):
+    write_mthd(file, division)
+    seekable = getattr(file, 'seekable', None)
+    if seekable is not None and seekable():
+        # Write a placeholder size and patch it once every note has been written
+        header_position = file.tell()
+        write_all(file, CHUNK_HEADER.pack(b'MTrk', 0), "MTRK header")
+        size = write_track_data(notes, file, chunk_notes, compact)
+        end_position = file.tell()
+        file.seek(header_position)
+        write_all(file, CHUNK_HEADER.pack(b'MTrk', size), "MTRK header")
+        file.seek(end_position)
+    else:
+        # Only imported here as it noticeably slows down the start of the command line tools
+        import tempfile
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            size = write_track_data(notes, spool, chunk_notes, compact)
+            write_all(file, CHUNK_HEADER.pack(b'MTrk', size), "MTRK header")
+            spool.seek(0)
+            data = spool.read(SPOOL_MAX_SIZE)
+            while data:
+                write_all(file, data, "MTRK data")
+                data = spool.read(SPOOL_MAX_SIZE)
+
+
+def write_track_data(notes: Iterable[Tuple[int, int]], file: BinaryIO, chunk_notes: int = STREAM_CHUNK_NOTES,
+                     compact: bool = False) -> int:
+    notes = iter(notes)
+    size = 0
+    rest = 0
+    running_status = False
+    if metrics is not None:
+        start = perf_counter()
+    chunk = list(islice(notes, chunk_notes))
+    while chunk:
+        if metrics is not None:
+            # The notes are drawn lazily while the chunk is filled
+            encode_start = perf_counter()
+            metrics.record("populate", encode_start - start, len(chunk))
+        pitches, lengths = zip(*chunk)
+        data, rest = encode_notes(NoteArray(array('B', pitches), array('I', lengths)), rest, compact, running_status)
+        if metrics is not None:
+            metrics.record("encode", perf_counter() - encode_start, len(chunk), len(data))
+        running_status = compact and (running_status or len(data) > 0)
+        size += len(data)
+        if size + len(END_OF_TRACK) > MAX_CHUNK_SIZE:
+            raise MIDIWritingError("Riff too long! A MTRK chunk can hold at most {} bytes".format(MAX_CHUNK_SIZE))
+        write_all(file, data, "notes")
+        if metrics is not None:
+            start = perf_counter()
+        chunk = list(islice(notes, chunk_notes))
 
     # End of main track
-    written = file.write(bytes([0x01, 0xff, 0x2f, 0x00]))
-    if written != 4:
-        raise MIDIWritingError("Error when writing MTRK end! Wrote {} bytes instead of 4".format(written))
+    end_of_track = encode_end_of_track(rest)
+    write_all(file, end_of_track, "MTRK end")
+    return size + len(end_of_track)
 
 
 def write_useless_mtrk(file: BinaryIO):
@@ -0,0 +1,304 @@
+import argparse
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import Iterator, Tuple, NamedTuple, Union, List
+
+from midi import Riff, NoteArray, MIDIReadingError, MIDIWritingError, CHUNK_HEADER, REST, encode_mthd, encode_track
+from sinks import find_container_index, read_container_entries
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+MTHD_DATA = struct.Struct('>HHH')
+
+
+class Event(NamedTuple):
+    delta: int
+    status: int
+    data: bytes
+
+
+class Header(NamedTuple):
+    format: int
+    tracks: int
+    division: int
+
+
+def read_vlq(view: memoryview, offset: int) -> Tuple[int, int]:
+    value = 0
+    end = offset + 4 if offset + 4 < len(view) else len(view)
+    for position in range(offset, end):
+        byte = view[position]
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value, position + 1
+    raise MIDIReadingError("Invalid variable length quantity at byte {}".format(offset))
+
+
+def iter_chunks(buffer: Buffer) -> Iterator[Tuple[bytes, memoryview]]:
+    view = memoryview(buffer)
+    offset = 0
+    while offset < len(view):
+        if offset + CHUNK_HEADER.size > len(view):
+            raise MIDIReadingError("Truncated chunk header at byte {}".format(offset))
+        chunk_type, size = CHUNK_HEADER.unpack_from(view, offset)
+        offset += CHUNK_HEADER.size
+        if offset + size > len(view):
+            raise MIDIReadingError("Truncated {} chunk at byte {}".format(chunk_type, offset))
+        yield chunk_type, view[offset:offset + size]
+        offset += size
+
+
+def read_header(chunk: memoryview) -> Header:
+    if len(chunk) < MTHD_DATA.size:
+        raise MIDIReadingError("MTHD chunk too short")
+    return Header(*MTHD_DATA.unpack_from(chunk, 0))
+
+
+def iter_events(track: memoryview) -> Iterator[Event]:
+    offset = 0
+    size = len(track)
+    status = None
+    while offset < size:
+        # Most deltas fit in a single byte
+        delta = track[offset]
+        if delta < 0x80:
+            offset += 1
+        else:
+            delta, offset = read_vlq(track, offset)
+        if offset >= size:
+            raise MIDIReadingError("Truncated event at byte {}".format(offset))
+        if track[offset] >= 0x80:
+            status = track[offset]
+            offset += 1
+        elif status is None:
+            raise MIDIReadingError("Running status without a previous status at byte {}".format(offset))
+
+        if status == 0xff:
+            # Meta event: type, length, data
+            if offset >= size:
+                raise MIDIReadingError("Truncated meta event at byte {}".format(offset))
+            meta_type = track[offset]
+            length, start = read_vlq(track, offset + 1)
+            data = bytes(track[offset:offset + 1]) + bytes(track[start:start + length])
+            offset = start + length
+            if meta_type == 0x2f:
+                yield Event(delta, status, data)
+                return
+        elif status in (0xf0, 0xf7):
+            length, start = read_vlq(track, offset)
+            data = bytes(track[start:start + length])
+            offset = start + length
+        else:
+            length = 1 if status & 0xf0 in (0xc0, 0xd0) else 2
+            data = bytes(track[offset:offset + length])
+            offset += length
+        if offset > size:
+            raise MIDIReadingError("Truncated event data at byte {}".format(offset))
+        yield Event(delta, status, data)
+
+
+def read_tracks(buffer: Buffer) -> Tuple[Header, Iterator[Iterator[Event]]]:
+    chunks = iter_chunks(buffer)
+    chunk_type, chunk = next(chunks, (None, None))
+    if chunk_type != b'MThd':
+        raise MIDIReadingError("Missing MTHD chunk")
+    tracks = (iter_events(chunk) for chunk_type, chunk in chunks if chunk_type == b'MTrk')
+    return read_header(chunk), tracks
+
+
+def iter_tracks(buffer: Buffer) -> Iterator[Iterator[Event]]:
+    return read_tracks(buffer)[1]
+
+
+def read_notes(events: Iterator[Event]) -> NoteArray:
+    notes = NoteArray()
+    time = 0
+    # Time at which the last note was released
+    released = 0
+    # Start time and position in the note array of the notes currently playing, by pitch
+    playing = {}
+    try:
+        for delta, status, data in events:
+            time += delta
+            kind = status & 0xf0
+            if kind == 0x90 and data[1]:
+                if time > released and not playing:
+                    notes.append(REST, time - released)
+                playing[data[0]] = (time, len(notes))
+                notes.append(data[0], 0)
+            elif kind == 0x80 or kind == 0x90:
+                start = playing.pop(data[0], None)
+                if start is None:
+                    continue
+                notes.lengths[start[1]] = time - start[0]
+                released = time
+            elif status == 0xff and data[0] == 0x2f and time > released + 1 and not playing:
+                # The end of track comes one tick after the last note, anything longer is a trailing rest
+                notes.append(REST, time - released - 1)
+    except OverflowError:
+        raise MIDIReadingError("Note or rest longer than the {} ticks a note array can hold".format(0xffffffff))
+    if playing:
+        raise MIDIReadingError("{} notes are never released".format(len(playing)))
+    return notes
+
+
+def parse(buffer: Buffer) -> Tuple[Header, NoteArray]:
+    header, tracks = read_tracks(buffer)
+    notes = NoteArray()
+    for track in tracks:
+        track_notes = read_notes(track)
+        notes.pitches.extend(track_notes.pitches)
+        notes.lengths.extend(track_notes.lengths)
+    return header, notes
+
+
+def parse_notes(buffer: Buffer) -> NoteArray:
+    return parse(buffer)[1]
+
+
+@contextmanager
+def map_file(path: str) -> Iterator[mmap.mmap]:
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise MIDIReadingError("{} is empty".format(path))
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield mapped
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # Views on the mapping are still referenced, by a traceback for instance, it is unmapped once they are
+            # garbage collected
+            pass
+
+
+def iter_file_events(path: str) -> Iterator[Event]:
+    with map_file(path) as mapped:
+        for track in iter_tracks(mapped):
+            yield from track
+
+
+def read_file(path: str) -> NoteArray:
+    with map_file(path) as mapped:
+        return parse_notes(mapped)
+
+
+def read_riff(path: str) -> Riff:
+    with map_file(path) as mapped:
+        header, notes = parse(mapped)
+    # The allowed rhythm of a riff read back is made of the note lengths it holds
+    lengths = sorted(set(notes.lengths.tolist()) - {0}) or None
+    try:
+        riff = Riff(number_notes=len(notes) or 1, allowed_rhythm=lengths, division=header.division)
+    except ValueError as e:
+        raise MIDIReadingError("{} cannot be loaded as a riff: {}".format(path, e))
+    riff.notes = notes
+    return riff
+
+
+def encode_file(notes: NoteArray, division: int, compact: bool = False) -> bytes:
+    track = encode_track(notes, compact)
+    return encode_mthd(division) + CHUNK_HEADER.pack(b'MTrk', len(track)) + track
+
+
+def verify(buffer: Buffer, name: str) -> NoteArray:
+    header, notes = parse(buffer)
+    data = bytes(buffer)
+    try:
+        if encode_file(notes, header.division) != data and encode_file(notes, header.division, True) != data:
+            raise MIDIReadingError("{} does not round-trip".format(name))
+    except MIDIWritingError as e:
+        # A file the writer cannot produce, such as one with a SMPTE division or invalid pitches
+        raise MIDIReadingError("{} does not round-trip: {}".format(name, e))
+    return notes
+
+
+def verify_file(path: str) -> NoteArray:
+    with map_file(path) as mapped:
+        return verify(mapped, path)
+
+
+class Container:
+    def __init__(self, buffer: Buffer):
+        found = find_container_index(buffer if hasattr(buffer, "rfind") else bytes(buffer))
+        if found is None:
+            raise MIDIReadingError("Not a riff container")
+        index_offset, count, _ = found
+        self.view = memoryview(buffer)
+        self.entries = read_container_entries(self.view, index_offset, count)
+
+    def __len__(self) -> int:
+        return len(self.entries) // 2
+
+    def __getitem__(self, index: int) -> memoryview:
+        # Goes through a range to support negative indices and raise an IndexError when out of range
+        index = range(len(self))[index]
+        return self.view[self.entries[2 * index]:self.entries[2 * index + 1]]
+
+    def __iter__(self) -> Iterator[memoryview]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+@contextmanager
+def open_container(path: str) -> Iterator[Container]:
+    with map_file(path) as mapped:
+        yield Container(mapped)
+
+
+def iter_container(path: str) -> Iterator[NoteArray]:
+    with open_container(path) as container:
+        for data in container:
+            yield parse_notes(data)
+
+
+def midi_files(path: str) -> List[str]:
+    return sorted(entry.path for entry in os.scandir(path) if entry.is_file() and entry.name.endswith(".mid"))
+
+
+def iter_directory(path: str) -> Iterator[Tuple[str, NoteArray]]:
+    for file_path in midi_files(path):
+        yield file_path, read_file(file_path)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Parse generated MIDI files and check they round-trip")
+    parser.add_argument("directory", help="directory of MIDI files, or a .riffs container")
+    args = parser.parse_args(argv)
+
+    notes = failures = count = 0
+    if os.path.isfile(args.directory):
+        try:
+            with open_container(args.directory) as container:
+                count = len(container)
+                for index, data in enumerate(container):
+                    try:
+                        notes += len(verify(data, "riff {}".format(index)))
+                    except MIDIReadingError as e:
+                        print("{}[{}]: {}".format(args.directory, index, e))
+                        failures += 1
+        except (MIDIReadingError, OSError) as e:
+            parser.exit(1, "{}: {}\n".format(args.directory, e))
+    else:
+        try:
+            files = midi_files(args.directory)
+        except OSError as e:
+            parser.exit(1, "{}\n".format(e))
+        count = len(files)
+        for path in files:
+            # A corrupt or unreadable file is reported without stopping the scan
+            try:
+                notes += len(verify_file(path))
+            except (MIDIReadingError, OSError) as e:
+                print("{}: {}".format(path, e))
+                failures += 1
+    print("{} files, {} notes, {} failures".format(count, notes, failures))
+    if failures:
+        parser.exit(1)
+
+
+if __name__ == '__main__':
+    main()
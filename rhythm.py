@@ -0,0 +1,65 @@
+import math
+import random
+from functools import lru_cache
+from typing import Tuple, Sequence, Iterator, List
+
+# Quarter notes per bar, for 4/4
+DEFAULT_BEATS_PER_BAR = 4
+# Longest rhythm that can be filled, in multiples of the greatest common divisor of the note lengths. That is 128 bars
+# of 4/4 when sixty-fourth notes are allowed, a table of about 4 MB computed in a few dozen milliseconds.
+MAX_RHYTHM_UNITS = 8192
+
+
+@lru_cache(maxsize=4)
+def composition_counts(units: Tuple[int, ...], total: int) -> Tuple[int, ...]:
+    # Number of sequences of the units that add up to each length from 0 to total. The counts are exact integers of up
+    # to about total bits, so the table grows with the square of the total.
+    counts = [1] + [0] * total
+    for length in range(1, total + 1):
+        counts[length] = sum(counts[length - unit] for unit in units if unit <= length)
+    return tuple(counts)
+
+
+def rhythm_units(rhythm_ticks: Sequence[int], total_ticks: int) -> Tuple[int, Tuple[int, ...], Tuple[int, ...]]:
+    # A note length of 0 ticks would always be drawn without filling anything
+    if not rhythm_ticks or min(rhythm_ticks) <= 0 or total_ticks <= 0:
+        raise ValueError("Note lengths of {} ticks cannot fill {} ticks, every length must last at least one "
+                         "tick".format(", ".join(str(ticks) for ticks in rhythm_ticks), total_ticks))
+    # Works in multiples of the greatest common divisor of every length to keep the table small
+    divisor = math.gcd(total_ticks, *rhythm_ticks)
+    units = tuple(sorted(set(ticks // divisor for ticks in rhythm_ticks)))
+    if total_ticks // divisor > MAX_RHYTHM_UNITS:
+        raise ValueError("Cannot fill {} ticks in steps of {} ticks, rhythms are limited to {} steps".format(
+            total_ticks, divisor, MAX_RHYTHM_UNITS))
+    return divisor, units, composition_counts(units, total_ticks // divisor)
+
+
+def count_rhythms(rhythm_ticks: Sequence[int], total_ticks: int) -> int:
+    return rhythm_units(rhythm_ticks, total_ticks)[2][-1]
+
+
+def iter_rhythm(rhythm_ticks: Sequence[int], total_ticks: int, rng) -> Iterator[int]:
+    # Draws uniformly among every sequence of note lengths lasting exactly total_ticks: each length is picked with a
+    # probability proportional to the number of ways of filling what remains after it
+    divisor, units, counts = rhythm_units(rhythm_ticks, total_ticks)
+    if not counts[-1]:
+        raise ValueError("No rhythm made of notes of {} ticks lasts exactly {} ticks".format(
+            ", ".join(str(ticks) for ticks in sorted(set(rhythm_ticks))), total_ticks))
+    if not hasattr(rng, "randrange"):
+        # The counts do not fit in the integers of a numpy generator
+        rng = random.Random(int(rng.integers(1 << 63)))
+    remaining = total_ticks // divisor
+    while remaining:
+        draw = rng.randrange(counts[remaining])
+        for unit in units:
+            if unit > remaining:
+                break
+            draw -= counts[remaining - unit]
+            if draw < 0:
+                break
+        yield unit * divisor
+        remaining -= unit
+
+
+def fill_rhythm(rhythm_ticks: Sequence[int], total_ticks: int, rng) -> List[int]:
+    return list(iter_rhythm(rhythm_ticks, total_ticks, rng))
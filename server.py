@@ -0,0 +1,399 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import traceback
+from concurrent.futures import Executor, ProcessPoolExecutor
+from http import HTTPStatus
+from typing import Dict, List, Tuple, Optional
+from urllib.parse import urlsplit, parse_qs
+
+from batch import generate_chunk
+from markov import MarkovModel
+from midi import Riff, Scale, NoteValue, NoteLength, MTHD_HEADER, DEFAULT_DIVISION, encode, encode_mthd
+from rhythm import DEFAULT_BEATS_PER_BAR, count_rhythms
+from sinks import MAX_TRACKS
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+MAX_NOTES = 100000
+MAX_BARS = 1000
+# Notes generated for a single batch request, its count times its number of notes per riff
+MAX_BATCH_NOTES = 10 ** 7
+# Number of riffs waiting for or being generated above which new requests are turned down
+MAX_PENDING = 8192
+# Requests arriving within that many seconds are generated by the same task of the process pool
+BATCH_DELAY = 0.001
+BATCH_SIZE = 128
+KEEP_ALIVE_TIMEOUT = 15
+MAX_HEADERS = 100
+MAX_BODY_SIZE = 64 * 1024
+
+FLAG_VALUES = ("", "1", "true", "yes", "on")
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RiffRequest:
+    __slots__ = ('options', 'seed', 'compact', 'count')
+
+    def __init__(self, options: Dict, seed: Optional[int], compact: bool, count: int = 1):
+        self.options = options
+        self.seed = seed
+        self.compact = compact
+        self.count = count
+
+
+def query_value(query: Dict[str, List[str]], name: str) -> Optional[str]:
+    values = query.get(name)
+    return values[-1] if values else None
+
+
+def query_int(query: Dict[str, List[str]], name: str, minimum: int, maximum: int) -> Optional[int]:
+    value = query_value(query, name)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "{} must be an integer".format(name))
+    if not minimum <= number <= maximum:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "{} must be between {} and {}".format(name, minimum, maximum))
+    return number
+
+
+def query_enum(query: Dict[str, List[str]], name: str, enum):
+    value = query_value(query, name)
+    if value is None:
+        return None
+    try:
+        return enum[value]
+    except KeyError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "{} must be one of {}".format(name, ", ".join(enum.__members__)))
+
+
+def query_flag(query: Dict[str, List[str]], name: str) -> bool:
+    value = query_value(query, name)
+    return value is not None and value.lower() in FLAG_VALUES
+
+
+def parse_request(query: Dict[str, List[str]], batch: bool = False) -> RiffRequest:
+    rhythm = None
+    if "rhythm" in query:
+        # Either repeated or comma separated
+        names = [name for value in query["rhythm"] for name in value.split(",") if name]
+        rhythm = [query_enum({"rhythm": [name]}, "rhythm", NoteLength) for name in names] or None
+    options = {
+        "scale": query_enum(query, "scale", Scale),
+        "root": query_enum(query, "root", NoteValue),
+        "number_notes": query_int(query, "notes", 1, MAX_NOTES),
+        "allowed_rhythm": rhythm,
+        "division": query_int(query, "division", 1, 0x7fff) or DEFAULT_DIVISION,
+        "model": MarkovModel() if query_flag(query, "markov") else None,
+        "bars": query_int(query, "bars", 1, MAX_BARS),
+        "beats_per_bar": query_int(query, "beats_per_bar", 1, 64) or DEFAULT_BEATS_PER_BAR,
+    }
+    try:
+        # Only checks the note lengths, the bars are checked by check_bars in the process pool
+        riff = Riff(**options)
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+    seed = query_int(query, "seed", 0, 2 ** 63 - 1)
+    count = 1
+    if batch:
+        count = query_int(query, "count", 1, MAX_TRACKS) or 1
+        # Riffs filling bars hold at most as many notes as the shortest note length fits in them
+        notes = riff.total_ticks // min(riff.rhythm_ticks) if riff.total_ticks else options["number_notes"] or 16
+        if count * notes > MAX_BATCH_NOTES:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                            "A batch can hold at most {} notes".format(MAX_BATCH_NOTES))
+    return RiffRequest(options, seed, query_flag(query, "compact"), count)
+
+
+def check_bars(options: Dict) -> Optional[str]:
+    # Runs in the worker processes, building the table of the rhythms filling the bars takes up to a few dozen
+    # milliseconds. Returns why the bars cannot be filled, if they cannot.
+    riff = Riff(**options)
+    try:
+        if not count_rhythms(riff.rhythm_ticks, riff.total_ticks):
+            return "No rhythm made of the allowed note lengths fills exactly {} bars".format(options["bars"])
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def generate_riffs(requests: List[RiffRequest]) -> List[bytes]:
+    # Runs in the worker processes, a riff with the same parameters and seed as the command line tool is identical
+    riffs = []
+    for request in requests:
+        riff = Riff(**request.options, seed=request.seed)
+        riff.populate()
+        riffs.append(bytes(encode(riff, request.compact)))
+    return riffs
+
+
+def response_head(status: HTTPStatus, content_type: str, keep_alive: bool, length: int = None) -> bytes:
+    lines = ["HTTP/1.1 {} {}".format(status.value, status.phrase), "Content-Type: " + content_type,
+             "Connection: " + ("keep-alive" if keep_alive else "close")]
+    if length is None:
+        lines.append("Transfer-Encoding: chunked")
+    else:
+        lines.append("Content-Length: {}".format(length))
+    if status == HTTPStatus.SERVICE_UNAVAILABLE:
+        lines.append("Retry-After: 1")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def encode_chunk(data: bytes) -> bytes:
+    return b"%x\r\n" % len(data) + data + b"\r\n"
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, str, Dict[str, str]]]:
+    try:
+        line = await reader.readline()
+        while line in (b"\r\n", b"\n"):
+            # Tolerate empty lines between pipelined requests
+            line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) == MAX_HEADERS:
+                raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Too many headers")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+    except (ValueError, asyncio.LimitOverrunError):
+        raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Request line or header too long")
+
+    length = headers.get("content-length", "0")
+    if not length.isdigit() or int(length) > MAX_BODY_SIZE:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Invalid or too large request body")
+    if int(length):
+        # Parameters are only read from the query string
+        await reader.readexactly(int(length))
+    return parts[0], parts[1], parts[2], headers
+
+
+def wants_keep_alive(version: str, headers: Dict[str, str]) -> bool:
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+class RiffServer:
+    def __init__(self, workers: int = None, executor: Executor = None, batch_size: int = BATCH_SIZE,
+                 batch_delay: float = BATCH_DELAY, max_pending: int = MAX_PENDING, chunk_size: int = 256):
+        self.workers = workers or os.cpu_count() or 1
+        if executor is None:
+            # Forked workers would inherit the sockets of the clients connected when they are started, and keep them
+            # open. The workers of a fork server are forked from a clean process instead.
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None
+            executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+        self.executor = executor
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.chunk_size = chunk_size
+        # Riffs queued or being generated, counted against max_pending
+        self.pending = 0
+        self.queue: List[Tuple[RiffRequest, asyncio.Future]] = []
+        self.flush_handle = None
+        self.tasks = set()
+        self.slots: Optional[asyncio.Semaphore] = None
+
+    async def start(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> asyncio.AbstractServer:
+        # Bounds the number of tasks handed to the process pool, the others wait in the queue
+        self.slots = asyncio.Semaphore(self.workers * 2)
+        # Starts the workers before accepting connections, so that the first requests do not wait for them
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, int) for _ in range(self.workers)))
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def reserve(self, count: int):
+        if self.pending + count > self.max_pending:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Too many riffs are being generated, retry later")
+        self.pending += count
+
+    def generate(self, request: RiffRequest) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((request, future))
+        if len(self.queue) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_delay, self.flush)
+        return future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.queue = self.queue, []
+        if batch:
+            self.spawn(self.run_batch(batch))
+
+    def spawn(self, coroutine):
+        # Keeps a reference to the task so that it is not garbage collected while running
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, batch: List[Tuple[RiffRequest, asyncio.Future]]):
+        async with self.slots:
+            try:
+                riffs = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, generate_riffs, [request for request, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+        for (_, future), data in zip(batch, riffs):
+            if not future.done():
+                future.set_result(data)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                except HTTPError as e:
+                    await self.send(writer, e.status, e.message.encode() + b"\n", "text/plain", False)
+                    break
+                if request is None:
+                    break
+                method, target, version, headers = request
+                keep_alive = wants_keep_alive(version, headers)
+                try:
+                    await self.route(method, target, writer, keep_alive)
+                except HTTPError as e:
+                    await self.send(writer, e.status, e.message.encode() + b"\n", "text/plain", keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            # The response may have been partly sent, the connection cannot be reused
+            traceback.print_exc()
+        finally:
+            writer.close()
+
+    async def send(self, writer: asyncio.StreamWriter, status: HTTPStatus, body: bytes, content_type: str,
+                   keep_alive: bool):
+        writer.write(response_head(status, content_type, keep_alive, len(body)) + body)
+        await writer.drain()
+
+    async def route(self, method: str, target: str, writer: asyncio.StreamWriter, keep_alive: bool):
+        url = urlsplit(target)
+        if url.path not in ("/riff", "/riffs"):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Unknown path {}, use /riff or /riffs".format(url.path))
+        if method != "GET":
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "Only GET is supported")
+        query = parse_qs(url.query, keep_blank_values=True)
+        request = parse_request(query, batch=url.path == "/riffs")
+        self.reserve(request.count)
+        try:
+            if request.options["bars"]:
+                message = await asyncio.get_running_loop().run_in_executor(self.executor, check_bars, request.options)
+                if message:
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, message)
+            if url.path == "/riff":
+                await self.send_riff(request, writer, keep_alive)
+            else:
+                await self.send_riffs(request, writer, keep_alive)
+        finally:
+            self.pending -= request.count
+
+    async def send_riff(self, request: RiffRequest, writer: asyncio.StreamWriter, keep_alive: bool):
+        try:
+            data = await self.generate(request)
+        except Exception:
+            traceback.print_exc()
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, "Generation failed")
+        await self.send(writer, HTTPStatus.OK, data, "audio/midi", keep_alive)
+
+    async def send_riffs(self, request: RiffRequest, writer: asyncio.StreamWriter, keep_alive: bool):
+        # Streams a format 1 file with one track per riff, the tracks are sent as soon as each chunk is generated
+        options = request.options
+        seed = request.seed if request.seed is not None else random.getrandbits(63)
+        loop = asyncio.get_running_loop()
+        pending = []
+        try:
+            writer.write(response_head(HTTPStatus.OK, "audio/midi", keep_alive) +
+                         encode_chunk(encode_mthd(options["division"], request.count)))
+            for start in range(0, request.count, self.chunk_size):
+                pending.append(loop.run_in_executor(
+                    self.executor, generate_chunk, seed, start, min(self.chunk_size, request.count - start),
+                    options["scale"], options["root"], options["number_notes"], options["allowed_rhythm"], False,
+                    options["division"], request.compact, options["model"], options["bars"],
+                    options["beats_per_bar"]))
+                if len(pending) < self.workers:
+                    continue
+                await self.send_chunk(writer, await pending.pop(0))
+            for future in pending:
+                await self.send_chunk(writer, await future)
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def send_chunk(self, writer: asyncio.StreamWriter, riffs: List[bytes]):
+        writer.write(encode_chunk(b"".join(memoryview(data)[MTHD_HEADER.size:] for data in riffs)))
+        # Waits for slow clients instead of buffering the whole batch
+        await writer.drain()
+
+
+async def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, **kwargs):
+    riff_server = RiffServer(**kwargs)
+    server = await riff_server.start(host, port)
+    print("Serving riffs on http://{}:{}/riff".format(host, port), file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        riff_server.close()
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Serve random MIDI riffs over HTTP. GET /riff returns a single riff "
+                                                 "and /riffs?count=N a format 1 file with one track per riff. Both "
+                                                 "accept the scale, root, notes, rhythm, division, bars, "
+                                                 "beats_per_bar, seed, markov and compact parameters")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on (defaults to localhost only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, help="number of worker processes (defaults to the CPU count)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="maximum number of requests generated by the same worker task")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING,
+                        help="number of riffs in progress above which requests are answered with 503")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers, batch_size=args.batch_size,
+                          max_pending=args.max_pending))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import io
+import mmap
+import os
+import struct
+import sys
+import tarfile
+import time
+import zipfile
+from array import array
+from typing import Optional, Tuple
+
+from midi import MIDIWritingError, MTHD_HEADER, DEFAULT_DIVISION, encode_mthd, write_all
+
+# Buffer of the single file sinks, many riffs are gathered in each write instead of one or more writes per riff
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# The number of tracks of a MIDI file is stored on 16 bits
+MAX_TRACKS = 0xffff
+
+# Riff containers start with the magic, followed by the riffs one after the other, the start and end offsets of every
+# riff and a trailer holding the magic, the offset of that index and the number of riffs. Appending leaves the previous
+# index and trailer in place and writes a new one after the new riffs, the last complete trailer is the valid one.
+CONTAINER_MAGIC = b'RIFX'
+CONTAINER_TRAILER = struct.Struct('>4sQQ')
+CONTAINER_ENTRY_SIZE = 16
+
+
+class DirectorySink:
+    def __init__(self, path: str, name_format: str = "riff_{:07d}.mid"):
+        self.path = path
+        self.name_format = name_format
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, index: int, data: bytes):
+        with open(os.path.join(self.path, self.name_format.format(index)), "wb") as file:
+            write_all(file, data, "MIDI file")
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TarSink:
+    def __init__(self, path: str, name_format: str = "riff_{:07d}.mid"):
+        self.name_format = name_format
+        self.mtime = int(time.time())
+        self.archive = tarfile.open(path, "w|", bufsize=WRITE_BUFFER_SIZE)
+
+    def add(self, index: int, data: bytes):
+        info = tarfile.TarInfo(self.name_format.format(index))
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ZipSink:
+    def __init__(self, path: str, name_format: str = "riff_{:07d}.mid"):
+        self.name_format = name_format
+        self.date_time = time.localtime()[:6]
+        self.file = open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+        # Riffs are a few dozen bytes, compressing them one by one is not worth it
+        self.archive = zipfile.ZipFile(self.file, "w", zipfile.ZIP_STORED, allowZip64=True)
+
+    def add(self, index: int, data: bytes):
+        self.archive.writestr(zipfile.ZipInfo(self.name_format.format(index), self.date_time), data)
+
+    def close(self):
+        self.archive.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MultiTrackSink:
+    def __init__(self, path: str, division: int = DEFAULT_DIVISION):
+        self.division = division
+        # Header of the single track files produced by the encoder
+        self.riff_header = encode_mthd(division)
+        self.tracks = 0
+        self.file = open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+        # The number of tracks is patched once every riff has been written
+        write_all(self.file, encode_mthd(division, 0), "MTHD chunk")
+
+    def add(self, index: int, data: bytes):
+        if data[:MTHD_HEADER.size] != self.riff_header:
+            raise MIDIWritingError("Riff {} is not a single track file with a division of {}".format(index,
+                                                                                                   self.division))
+        if self.tracks == MAX_TRACKS:
+            raise MIDIWritingError("A MIDI file can hold at most {} tracks".format(MAX_TRACKS))
+        write_all(self.file, memoryview(data)[MTHD_HEADER.size:], "MTRK chunk")
+        self.tracks += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            self.file.seek(0)
+            write_all(self.file, encode_mthd(self.division, self.tracks), "MTHD chunk")
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def find_container_index(buffer) -> Optional[Tuple[int, int, int]]:
+    # Offset and number of entries of the last complete index, and the end of its trailer. What follows was written by
+    # a run that did not close the container and is not referenced by any index.
+    if len(buffer) < len(CONTAINER_MAGIC) + CONTAINER_TRAILER.size or buffer[:len(CONTAINER_MAGIC)] != CONTAINER_MAGIC:
+        return None
+    position = len(buffer) - CONTAINER_TRAILER.size
+    while position >= len(CONTAINER_MAGIC):
+        magic, index_offset, count = CONTAINER_TRAILER.unpack_from(buffer, position)
+        if magic == CONTAINER_MAGIC and index_offset >= len(CONTAINER_MAGIC) and \
+                index_offset + count * CONTAINER_ENTRY_SIZE == position:
+            return index_offset, count, position + CONTAINER_TRAILER.size
+        # Previous trailer candidate
+        position = buffer.rfind(CONTAINER_MAGIC, len(CONTAINER_MAGIC), position + len(CONTAINER_MAGIC) - 1)
+    return None
+
+
+def read_container_entries(buffer, index_offset: int, count: int) -> array:
+    # Start and end offsets of every riff, one after the other
+    entries = array('Q')
+    entries.frombytes(buffer[index_offset:index_offset + count * CONTAINER_ENTRY_SIZE])
+    if sys.byteorder == "little":
+        entries.byteswap()
+    return entries
+
+
+def read_container_index(file, path: str) -> Tuple[array, int]:
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        found = find_container_index(mapped)
+        if found is None:
+            raise MIDIWritingError("{} is not a riff container".format(path))
+        index_offset, count, end = found
+        return read_container_entries(mapped, index_offset, count), end
+
+
+class ContainerSink:
+    def __init__(self, path: str):
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # Append after the last complete index, which stays valid until a new one is written when the sink is
+            # closed. Riffs left behind by an interrupted run are not in any index and are dropped.
+            self.file = open(path, "r+b", buffering=WRITE_BUFFER_SIZE)
+            try:
+                self.entries, self.position = read_container_index(self.file, path)
+                self.file.truncate(self.position)
+                self.file.seek(self.position)
+            except Exception:
+                self.file.close()
+                raise
+        else:
+            self.file = open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+            self.entries = array('Q')
+            write_all(self.file, CONTAINER_MAGIC, "container magic")
+            self.position = len(CONTAINER_MAGIC)
+
+    def add(self, index: int, data: bytes):
+        write_all(self.file, data, "MIDI file")
+        self.entries.append(self.position)
+        self.position += len(data)
+        self.entries.append(self.position)
+
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            index = array('Q', self.entries)
+            if sys.byteorder == "little":
+                index.byteswap()
+            write_all(self.file, index.tobytes(), "container index")
+            write_all(self.file, CONTAINER_TRAILER.pack(CONTAINER_MAGIC, self.position, len(self.entries) // 2),
+                      "container trailer")
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_sink(path: str, division: int = DEFAULT_DIVISION):
+    if path.endswith(".tar"):
+        return TarSink(path)
+    if path.endswith(".zip"):
+        return ZipSink(path)
+    if path.endswith(".mid") or path.endswith(".midi"):
+        return MultiTrackSink(path, division)
+    if path.endswith(".riffs"):
+        return ContainerSink(path)
+    return DirectorySink(path)
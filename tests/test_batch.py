@@ -0,0 +1,34 @@
+import pytest
+
+import batch
+from batch import batch_riff, generate_chunk
+from markov import MarkovModel
+from midi import encode
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+@pytest.mark.parametrize("model", [None, MarkovModel()])
+def test_chunks_are_independent(vectorized, model):
+    if vectorized:
+        pytest.importorskip("numpy")
+    whole = generate_chunk(7, 0, 8, number_notes=8, vectorized=vectorized, model=model)
+    split = generate_chunk(7, 0, 4, number_notes=8, vectorized=vectorized, model=model) + \
+        generate_chunk(7, 4, 4, number_notes=8, vectorized=vectorized, model=model)
+    assert whole == split
+    # Any riff of the batch can be regenerated on its own
+    assert generate_chunk(7, 5, 1, number_notes=8, vectorized=vectorized, model=model) == whole[5:6]
+    if not vectorized:
+        riff = batch_riff(7, 5, number_notes=8, model=model)
+        riff.populate()
+        assert bytes(encode(riff)) == whole[5]
+
+
+@pytest.mark.parametrize("options", [dict(number_notes=8), dict(number_notes=8, model=MarkovModel()), dict(bars=1)])
+def test_vectorized_blocks(monkeypatch, options):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(batch, "VECTORIZED_BLOCK_RIFFS", 4)
+    whole = generate_chunk(3, 0, 13, vectorized=True, **options)
+    assert len(whole) == 13 and len(set(whole)) == 13
+    # Chunks that do not line up with the blocks
+    split = [generate_chunk(3, start, min(3, 13 - start), vectorized=True, **options) for start in range(0, 13, 3)]
+    assert sum(split, []) == whole
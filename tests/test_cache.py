@@ -0,0 +1,62 @@
+import os
+
+from cache import DiskStore, RiffCache, cache_key
+from midi import NoteLength
+
+
+def test_cache_key():
+    key = cache_key(number_notes=8, allowed_rhythm=[NoteLength.QUARTER], seed=1)
+    assert key == cache_key(number_notes=8, allowed_rhythm=[NoteLength.QUARTER], seed=1)
+    assert key != cache_key(number_notes=8, allowed_rhythm=[NoteLength.QUARTER], seed=2)
+    assert key != cache_key(number_notes=8, allowed_rhythm=[NoteLength.QUARTER], seed=1, compact=True)
+    # A quarter note lasts a division worth of ticks, not 16 ticks
+    assert key != cache_key(number_notes=8, allowed_rhythm=[16], seed=1)
+    assert key == cache_key(number_notes=8, allowed_rhythm=[NoteLength.QUARTER.ticks(480)], seed=1)
+    assert key != cache_key(number_notes=8, allowed_rhythm=[NoteLength.QUARTER], seed=1, division=960)
+
+
+def test_memory_eviction():
+    cache = RiffCache(max_entries=2)
+    cache.put("a", b"a")
+    cache.put("b", b"b")
+    assert cache.get("a") == b"a"
+    cache.put("c", b"c")
+    # The least recently used entry is evicted
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a"
+    assert cache.get("c") == b"c"
+
+
+def test_disk_eviction(tmp_path):
+    store = DiskStore(str(tmp_path), max_size=10)
+    store.put("a", b"aaaa")
+    store.put("b", b"bbbb")
+    assert store.get("a") == b"aaaa"
+    store.put("c", b"cccc")
+    assert store.size == 8
+    assert store.get("b") is None
+    assert not os.path.exists(store.file_path("b"))
+    assert store.get("a") == b"aaaa"
+    # Larger than the whole store
+    store.put("d", b"d" * 11)
+    assert store.get("d") is None
+
+    reopened = DiskStore(str(tmp_path), max_size=10)
+    assert reopened.size == 8
+    assert set(reopened.entries) == {"a", "c"}
+
+
+def test_counters(tmp_path):
+    cache = RiffCache(directory=str(tmp_path))
+    data = cache.encode(number_notes=8, seed=1)
+    assert cache.encode(number_notes=8, seed=1) == data
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 1
+
+    reopened = RiffCache(directory=str(tmp_path))
+    assert reopened.encode(number_notes=8, seed=1) == data
+    assert reopened.stats() == {"hits": 0, "disk_hits": 1, "misses": 0, "entries": 1, "disk_entries": 1,
+                                "disk_size": len(data)}
+    # Unseeded riffs are never cached
+    reopened.encode(number_notes=8)
+    assert reopened.stats()["entries"] == 1
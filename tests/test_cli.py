@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import cli
+from midi import Riff, NoteLength, encode
+from reader import read_riff
+
+
+def test_output_file(tmp_path):
+    path = tmp_path / "riff.mid"
+    cli.main(["--seed", "3", "--notes", "12", "--rhythm", "QUARTER", "--rhythm", "EIGHTH", "-o", str(path)])
+    riff = Riff(number_notes=12, allowed_rhythm=[NoteLength.QUARTER, NoteLength.EIGHTH], seed=3)
+    riff.populate()
+    assert path.read_bytes() == bytes(encode(riff))
+
+
+def test_standard_output(capsysbinary, tmp_path):
+    path = tmp_path / "riff.mid"
+    cli.main(["--seed", "5", "--scale", "MAJOR_SCALE", "--root", "D", "-o", str(path)])
+    cli.main(["--seed", "5", "--scale", "MAJOR_SCALE", "--root", "D"])
+    assert capsysbinary.readouterr().out == path.read_bytes()
+
+
+def test_write_error(tmp_path):
+    with pytest.raises(SystemExit) as error:
+        cli.main(["--seed", "1", "-o", str(tmp_path)])
+    assert error.value.code == 1
+
+
+def test_headless_import():
+    # The command line tool starts without the GUI toolkit nor numpy
+    code = "import sys, cli; assert 'PyQt5' not in sys.modules and 'numpy' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(cli.__file__)))
+
+
+def test_bars(tmp_path):
+    path = tmp_path / "riff.mid"
+    cli.main(["--seed", "2", "--bars", "2", "--beats-per-bar", "3", "--rhythm", "QUARTER", "--rhythm", "EIGHTH", "-o",
+              str(path)])
+    riff = read_riff(str(path))
+    assert sum(riff.notes.lengths) == 2 * 3 * 480
+
+
+@pytest.mark.parametrize("arguments, code", [
+    # Whole notes cannot fill a bar of 3 quarter notes
+    (["--bars", "1", "--beats-per-bar", "3", "--rhythm", "WHOLE"], 1),
+    (["--bars", "0"], 2),
+    (["--bars", "1000"], 2),
+    # Sixty-fourth notes do not last a whole number of ticks
+    (["--division", "100"], 2),
+    (["--division", "0"], 2),
+])
+def test_invalid_options(tmp_path, arguments, code):
+    with pytest.raises(SystemExit) as error:
+        cli.main(arguments + ["-o", str(tmp_path / "riff.mid")])
+    assert error.value.code == code
+    assert not (tmp_path / "riff.mid").exists()
@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+import batch
+from batch import generate_batch, generate_chunk
+from dedup import KEY_SIZE, BloomFilter, Deduplicator, riff_key
+from midi import NoteArray, NoteLength, REST
+from reader import iter_directory
+
+RIFF = NoteArray.from_notes([(60, 480), (REST, 240), (64, 240), (67, 960)])
+TRANSPOSED = NoteArray.from_notes([(62, 480), (REST, 240), (66, 240), (69, 960)])
+
+
+def keys(count):
+    return [riff_key(NoteArray.from_notes([(index % 0x80, 1 + index // 0x80)])) for index in range(count)]
+
+
+def test_riff_key():
+    assert len(riff_key(RIFF)) == KEY_SIZE
+    assert riff_key(RIFF) == riff_key(NoteArray.from_notes(list(RIFF)))
+    assert riff_key(RIFF) != riff_key(TRANSPOSED)
+    assert riff_key(RIFF, True) == riff_key(TRANSPOSED, True)
+    # Same pitches with other lengths
+    assert riff_key(RIFF, True) != riff_key(NoteArray.from_notes([(62, 480), (REST, 480), (66, 240), (69, 960)]), True)
+    # Leading rests are not a base to transpose from
+    assert riff_key(NoteArray.from_notes([(REST, 10), (60, 1)]), True) == \
+        riff_key(NoteArray.from_notes([(REST, 10), (70, 1)]), True)
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, 0.01)
+    added = keys(2000)
+    # A few new keys are taken for known ones, at about the error rate
+    assert sum(bloom.add(key) for key in added[:1000]) > 980
+    assert all(key in bloom for key in added[:1000])
+    assert not bloom.add(added[0])
+    assert len(bloom) > 980
+    assert sum(key in bloom for key in added[1000:]) < 30
+
+
+@pytest.mark.parametrize("capacity, error_rate", [(0, 0.01), (100, 0), (100, 1)])
+def test_bloom_filter_invalid(capacity, error_rate):
+    with pytest.raises(ValueError):
+        BloomFilter(capacity, error_rate)
+
+
+@pytest.mark.parametrize("bloom", [None, 1000])
+def test_deduplicator(bloom):
+    dedup = Deduplicator(bloom_capacity=bloom)
+    assert dedup.add(RIFF) and dedup.add(TRANSPOSED)
+    assert not dedup.add(RIFF)
+    assert dedup.duplicates == 1 and len(dedup) == 2
+    dedup = Deduplicator(transpose=True, bloom_capacity=bloom)
+    assert dedup.add(RIFF) and not dedup.add(TRANSPOSED)
+
+
+def test_index_file(tmp_path):
+    path = str(tmp_path / "keys")
+    with Deduplicator(path) as dedup:
+        assert dedup.add(RIFF) and not dedup.add(RIFF)
+        dedup.commit()
+        # Keys that are not committed are not written
+        assert dedup.add(TRANSPOSED)
+    assert os.path.getsize(path) == KEY_SIZE
+    # An interrupted write leaves a partial key, dropped on the next run
+    with open(path, "ab") as file:
+        file.write(riff_key(TRANSPOSED)[:5])
+    with Deduplicator(path) as dedup:
+        assert len(dedup) == 1
+        assert not dedup.add(RIFF) and dedup.add(TRANSPOSED)
+        dedup.commit()
+    assert os.path.getsize(path) == 2 * KEY_SIZE
+
+
+def test_chunk_keys():
+    # A single quarter note of the scale, most of the riffs of the chunk are duplicates
+    chunk = generate_chunk(0, 0, 64, number_notes=1, allowed_rhythm=[NoteLength.QUARTER], keys=True)
+    assert len(chunk) == len({key for key, data in chunk}) < 64
+    assert all(len(key) == KEY_SIZE for key, data in chunk)
+
+
+def test_batch(tmp_path):
+    path = str(tmp_path / "keys")
+    output = str(tmp_path / "riffs")
+    options = dict(number_notes=1, allowed_rhythm=[NoteLength.QUARTER], output=output, workers=2, chunk_size=16)
+    with Deduplicator(path) as dedup:
+        written = generate_batch(64, dedup=dedup, **options)
+    riffs = [notes for _, notes in iter_directory(output)]
+    assert 0 < written == len(riffs) == len({riff_key(notes) for notes in riffs}) < 64
+    assert os.path.getsize(path) == written * KEY_SIZE
+    # Every riff of the next run is a duplicate of one already written
+    with Deduplicator(path) as dedup:
+        assert generate_batch(64, dedup=dedup, **dict(options, output=str(tmp_path / "more"))) == 0
+
+
+class FailingSink:
+    def __init__(self, fail_add=None, fail_close=False):
+        self.riffs = []
+        self.fail_add = fail_add
+        self.fail_close = fail_close
+
+    def add(self, index, data):
+        if index == self.fail_add:
+            raise OSError("No space left on device")
+        self.riffs.append(data)
+
+    def close(self):
+        if self.fail_close:
+            raise OSError("No space left on device")
+
+
+@pytest.mark.parametrize("fail_add, fail_close, committed", [(None, False, 4), (2, False, 2), (None, True, 0)])
+def test_batch_commit(tmp_path, monkeypatch, fail_add, fail_close, committed):
+    # Only the keys of the riffs the sink took and committed are recorded
+    sink = FailingSink(fail_add, fail_close)
+    monkeypatch.setattr(batch, "open_sink", lambda output, division: sink)
+    path = str(tmp_path / "keys")
+    with Deduplicator(path) as dedup:
+        try:
+            generate_batch(4, number_notes=8, dedup=dedup, workers=1)
+        except OSError:
+            pass
+        assert len(dedup) == len(sink.riffs)
+    assert os.path.getsize(path) == committed * KEY_SIZE
@@ -0,0 +1,65 @@
+import io
+
+import pytest
+
+import cli
+import instrumentation
+import midi
+from midi import Riff, encode, write
+
+
+@pytest.fixture
+def metrics():
+    metrics = instrumentation.enable()
+    yield metrics
+    instrumentation.disable()
+
+
+def test_stages(metrics, tmp_path):
+    riff = Riff(number_notes=12, seed=0)
+    riff.populate()
+    data = encode(riff)
+    with open(str(tmp_path / "riff.mid"), "wb") as file:
+        write(riff, file)
+    stages = metrics.snapshot()
+    assert stages["init"]["calls"] == 1
+    assert stages["populate"]["calls"] == 1 and stages["populate"]["notes"] == 12
+    assert stages["encode"]["calls"] == 2 and stages["encode"]["notes"] == 24
+    assert stages["write"]["calls"] == 1 and stages["write"]["bytes"] == len(data)
+    assert "populate" in metrics.report()
+
+
+def test_size_is_not_an_encode(metrics):
+    riff = Riff(number_notes=12, seed=0)
+    riff.populate()
+    riff.size()
+    assert metrics.snapshot()["encode"]["calls"] == 0
+
+
+def test_callback():
+    calls = []
+    instrumentation.enable(lambda *arguments: calls.append(arguments))
+    try:
+        Riff(number_notes=4, seed=0).populate()
+    finally:
+        assert instrumentation.disable() is not None
+    assert [call[0] for call in calls] == ["init", "populate"]
+    assert calls[1][2] == 4
+    assert midi.metrics is None
+
+
+def test_profile(tmp_path):
+    stream = io.StringIO()
+    stats = tmp_path / "riff.prof"
+    assert instrumentation.profile(lambda: 42, str(stats), stream) == 42
+    assert stats.exists()
+    report = stream.getvalue()
+    assert report.startswith("Stages:") and "Memory:" in report
+    assert midi.metrics is None
+
+
+def test_cli_profile(tmp_path):
+    stats = tmp_path / "riff.prof"
+    cli.main(["--seed", "1", "--notes", "8", "--profile", str(stats), "-o", str(tmp_path / "riff.mid")])
+    assert stats.exists() and (tmp_path / "riff.mid").exists()
+    assert midi.metrics is None
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+import live
+from live import (ALL_NOTES_OFF, CallbackSink, LatencyStats, Player, VirtualPortSink, iter_timed_events, note_off,
+                  note_on)
+from midi import REST
+
+NOTES = [(60, 480), (REST, 240), (62, 240), (64, 960)]
+
+
+class Clock:
+    # Moves forward by a tenth of a millisecond every time it is read
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        self.now += 0.0001
+        return self.now
+
+
+def test_timed_events():
+    assert list(iter_timed_events(NOTES)) == [
+        (0, note_on(60)), (480, note_off(60)), (720, note_on(62)), (960, note_off(62)), (960, note_on(64)),
+        (1920, note_off(64)),
+    ]
+    assert list(iter_timed_events([(REST, 10)])) == []
+
+
+def test_player():
+    messages = []
+    sink = CallbackSink(lambda message, timestamp: messages.append((timestamp, message)))
+    clock = Clock()
+    # A quarter note per second, 480 ticks per second. The player only spins on the clock instead of sleeping.
+    stats = Player(sink, tempo=60, division=480, spin=float("inf"), clock=clock).play(NOTES)
+    start = messages[0][0]
+    assert [message for _, message in messages] == [message for _, message in iter_timed_events(NOTES)]
+    assert [timestamp - start for timestamp, _ in messages] == pytest.approx([0, 1, 1.5, 2, 2, 4])
+    summary = stats.summary()
+    assert summary["events"] == 6 and 0 <= summary["max"] < 0.001
+
+
+def test_stop():
+    messages = []
+
+    def send(message, timestamp):
+        messages.append(message)
+        if len(messages) == 1:
+            player.stop()
+
+    player = Player(CallbackSink(send), spin=float("inf"), clock=Clock())
+    player.play(NOTES)
+    # The note playing is released and every note is silenced
+    assert messages == [note_on(60), note_off(60), ALL_NOTES_OFF]
+
+
+def test_virtual_port():
+    sink = VirtualPortSink()
+    received = []
+    thread = threading.Thread(target=lambda: received.extend(sink))
+    thread.start()
+    Player(sink, tempo=6000).play(NOTES)
+    sink.close()
+    thread.join()
+    assert [message for _, message in received] == [message for _, message in iter_timed_events(NOTES)]
+
+
+def test_latency_stats():
+    stats = LatencyStats()
+    assert stats.summary() == {"events": 0} and stats.report() == "No events"
+    for latency in (0.001, 0.003):
+        stats.add(latency)
+    summary = stats.summary()
+    assert summary["mean"] == pytest.approx(0.002) and summary["jitter"] == pytest.approx(0.001)
+    assert summary["max"] == summary["p99"] == 0.003
+
+
+def test_main(capsys):
+    live.main(["--seed", "1", "--notes", "3", "--rhythm", "SIXTEENTH", "--tempo", "6000", "--print"])
+    output = capsys.readouterr()
+    assert len(output.out.splitlines()) == 6
+    assert output.err.startswith("6 events")
+    with pytest.raises(SystemExit):
+        live.main(["--tempo", "0"])
@@ -0,0 +1,61 @@
+import random
+from collections import Counter
+
+import pytest
+
+from markov import (AliasTable, MarkovModel, TransitionTable, DEFAULT_RHYTHM_REPEAT, PITCH_TABLE_CACHE_SIZE,
+                    RHYTHM_TABLE_CACHE_SIZE, pitch_table, rhythm_table)
+from midi import CHROMATIC_NOTES, NoteArray
+
+
+@pytest.mark.parametrize("weights", [[1], [1, 1], [1, 2, 3, 4, 0], [0.5, 10, 0.25, 3], [7, 0, 0, 1]])
+def test_alias_frequencies(weights):
+    rng = random.Random(0)
+    draws = 50000
+    counts = Counter(AliasTable(weights).draw(rng) for _ in range(draws))
+    total = sum(weights)
+    for index, weight in enumerate(weights):
+        assert abs(counts[index] / draws - weight / total) < 0.01
+        if not weight:
+            assert not counts[index]
+
+
+@pytest.mark.parametrize("weights", [[], [0, 0], [1, -1]])
+def test_alias_invalid(weights):
+    with pytest.raises(ValueError):
+        AliasTable(weights)
+
+
+def test_transitions():
+    table = TransitionTable((10, 20), [[1, 3], [1, 0]])
+    walk = table.walk(random.Random(0))
+    states = [next(walk) for _ in range(20000)]
+    pairs = Counter(zip(states, states[1:]))
+    # 20 is always followed by 10, 10 by 20 three times out of four
+    assert not pairs[20, 20]
+    assert abs(pairs[10, 20] / (pairs[10, 10] + pairs[10, 20]) - 0.75) < 0.02
+
+
+def test_walk_many():
+    numpy = pytest.importorskip("numpy")
+    table = TransitionTable((10, 20), [[1, 3], [1, 0]])
+    states = table.walk_many((2000, 10), numpy.random.default_rng(0))
+    assert states.shape == (2000, 10) and states.flags.c_contiguous
+    following = states[:, 1:][states[:, :-1] == 10]
+    assert not (states[:, 1:][states[:, :-1] == 20] == 20).any()
+    assert abs((following == 20).mean() - 0.75) < 0.02
+
+
+def test_model_reproducible():
+    model = MarkovModel()
+    first = model.draw(CHROMATIC_NOTES, (120, 240), 50, random.Random(3))
+    assert isinstance(first, NoteArray) and len(first) == 50
+    assert first == model.draw(CHROMATIC_NOTES, (120, 240), 50, random.Random(3))
+
+
+def test_table_cache_bounded():
+    for division in range(1, RHYTHM_TABLE_CACHE_SIZE * 2):
+        rhythm_table((division, division * 2), DEFAULT_RHYTHM_REPEAT)
+    assert rhythm_table.cache_info().currsize == RHYTHM_TABLE_CACHE_SIZE
+    assert rhythm_table.cache_info().maxsize == RHYTHM_TABLE_CACHE_SIZE
+    assert pitch_table.cache_info().maxsize == PITCH_TABLE_CACHE_SIZE
@@ -0,0 +1,132 @@
+import io
+import random
+
+import pytest
+
+from markov import MarkovModel
+from midi import (Riff, NoteArray, NoteLength, REST, MIDIWritingError, STREAM_CHUNK_NOTES, encode_notes, encode_events,
+                  encode_track, encode_vlq, track_size, rhythm_to_ticks, write, write_stream)
+
+BOUNDARY_TICKS = [1, 0x7f, 0x80, 0x3fff]
+
+
+def reference_track(notes, compact=False):
+    # Straightforward encoding, one event at a time
+    track = bytearray()
+    rest = 0
+    status = False
+    for pitch, ticks in notes:
+        if pitch == REST:
+            rest += ticks
+            continue
+        track += encode_vlq(rest)
+        if not (compact and status):
+            track.append(0x90)
+        track += bytes((pitch, 0x40)) + encode_vlq(ticks) + bytes((pitch, 0x00))
+        rest = 0
+        status = True
+    return bytes(track + encode_vlq(rest + 1) + b'\xff\x2f\x00')
+
+
+def random_notes(rng, count, ticks, rests=False):
+    notes = []
+    for _ in range(count):
+        pitch = REST if rests and rng.random() < 0.2 else rng.randrange(0x80)
+        notes.append((pitch, rng.choice(ticks)))
+    return NoteArray.from_notes(notes)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("ticks", BOUNDARY_TICKS)
+def test_fast_path_matches_events(ticks, compact):
+    notes = NoteArray.from_notes((pitch, ticks) for pitch in (0, 0x3c, 0x7f, 0x40))
+    expected = encode_events(notes.pitches, notes.lengths, compact=compact)
+    assert encode_notes(notes, compact=compact) == expected
+    assert bytes(encode_track(notes, compact)) == reference_track(notes, compact)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_mixed_lengths_match_reference(compact):
+    rng = random.Random(0)
+    for count in range(0, 40):
+        notes = random_notes(rng, count, BOUNDARY_TICKS + [0x4000, 0x1fffff, 0x200000, 0x0fffffff])
+        assert bytes(encode_track(notes, compact)) == reference_track(notes, compact)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_rests(compact):
+    rng = random.Random(1)
+    for count in range(0, 40):
+        notes = random_notes(rng, count, BOUNDARY_TICKS, rests=True)
+        assert bytes(encode_track(notes, compact)) == reference_track(notes, compact)
+    # Leading and trailing rests only move the time of the next event
+    notes = NoteArray.from_notes([(REST, 0x80), (0x3c, 0x7f), (REST, 0x3fff), (REST, 1)])
+    assert bytes(encode_track(notes, compact)) == reference_track(notes, compact)
+
+
+def test_numpy_buffers():
+    numpy = pytest.importorskip("numpy")
+    rng = random.Random(2)
+    notes = random_notes(rng, 100, BOUNDARY_TICKS)
+    vectorized = NoteArray(numpy.array(notes.pitches, dtype=numpy.uint8),
+                           numpy.array(notes.lengths, dtype=numpy.uint32))
+    for compact in (False, True):
+        assert encode_track(vectorized, compact) == encode_track(notes, compact)
+
+
+def test_invalid_pitch():
+    with pytest.raises(MIDIWritingError):
+        encode_track(NoteArray.from_notes([(0x80, 1)]))
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_track_size(compact):
+    rng = random.Random(3)
+    for count in range(0, 40):
+        notes = random_notes(rng, count, BOUNDARY_TICKS + [0x4000, 0x200000], rests=count % 2 == 1)
+        assert track_size(notes, compact) == len(encode_track(notes, compact))
+    riff = Riff(number_notes=16, seed=0)
+    riff.populate()
+    assert riff.size(compact) == len(encode_track(riff.notes, compact))
+
+
+def test_notes_setter():
+    riff = Riff(division=960)
+    riff.notes = [(60, NoteLength.QUARTER), (REST, NoteLength.EIGHTH), (64, 16)]
+    assert list(riff.notes) == [(60, 960), (REST, 480), (64, 16)]
+    notes = NoteArray.from_notes([(60, 16)])
+    riff.notes = notes
+    assert riff.notes is notes
+
+
+def test_rhythm_ticks():
+    assert rhythm_to_ticks(NoteLength, 480) == (1920, 960, 480, 240, 120, 60, 30)
+    assert rhythm_to_ticks([NoteLength.QUARTER, 7], 100) == (100, 7)
+    # Memoized, without taking a note length for the number of ticks it is equal to
+    assert rhythm_to_ticks([NoteLength.QUARTER], 480) == (480,)
+    assert rhythm_to_ticks([16], 480) == (16,)
+    assert rhythm_to_ticks(iter([NoteLength.QUARTER]), 480) == (480,)
+    for rhythm, division in (([NoteLength.TH64], 100), ([NoteLength.TH64], 8), ([NoteLength.QUARTER], 0), ([0], 480)):
+        with pytest.raises(ValueError):
+            rhythm_to_ticks(rhythm, division)
+    with pytest.raises(ValueError):
+        Riff(division=100)
+
+
+@pytest.mark.parametrize("numpy_generator", [False, True])
+@pytest.mark.parametrize("options", [
+    dict(number_notes=STREAM_CHUNK_NOTES), dict(number_notes=STREAM_CHUNK_NOTES * 2 + 5),
+    dict(number_notes=5000, model=MarkovModel()), dict(bars=30),
+])
+def test_stream_matches_populate(numpy_generator, options):
+    # The streaming writer draws the notes by blocks, a riff with the same random source must be the same
+    def rng():
+        return pytest.importorskip("numpy").random.default_rng(4) if numpy_generator else random.Random(4)
+    riff = Riff(rng=rng(), **options)
+    riff.populate()
+    written = io.BytesIO()
+    write(riff, written)
+    streamed = io.BytesIO()
+    riff = Riff(rng=rng(), **options)
+    write_stream(riff.iter_notes(), streamed, riff.division)
+    assert streamed.getvalue() == written.getvalue()
@@ -0,0 +1,123 @@
+import random
+import struct
+
+import pytest
+
+import reader
+from midi import Riff, NoteArray, REST, MIDIReadingError, encode, encode_mthd, CHUNK_HEADER
+from reader import parse, read_file, read_riff, verify, verify_file
+from sinks import ContainerSink
+
+
+def riff_bytes(index, compact=False):
+    riff = Riff(number_notes=1 + index % 16, seed=index)
+    riff.populate()
+    return bytes(encode(riff, compact))
+
+
+def track_file(track, division=480):
+    return encode_mthd(division) + CHUNK_HEADER.pack(b'MTrk', len(track)) + track
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_round_trip(tmp_path, compact):
+    for index in range(50):
+        riff = Riff(number_notes=1 + index % 16, seed=index)
+        riff.populate()
+        path = tmp_path / "{}.mid".format(index)
+        path.write_bytes(bytes(encode(riff, compact)))
+        assert read_file(str(path)) == riff.notes
+        assert verify_file(str(path)) == riff.notes
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_rests_and_division(compact):
+    rng = random.Random(0)
+    for index in range(200):
+        notes = []
+        for position in range(rng.randint(1, 30)):
+            # A rest after another one would be merged with it
+            rest = position and notes[-1][0] != REST and rng.random() < 0.2
+            notes.append((REST if rest else rng.randrange(0x80), rng.choice([1, 0x7f, 0x80, 0x3fff, 0x4000, 480])))
+        notes = NoteArray.from_notes(notes)
+        riff = Riff(number_notes=len(notes), division=96)
+        riff.notes = notes
+        header, parsed = parse(bytes(encode(riff, compact)))
+        assert parsed == notes
+        assert header.division == 96 and header.tracks == 1
+
+
+def test_read_riff(tmp_path):
+    # A division that is not a multiple of 16 still loads, with the note lengths of the file as allowed rhythm
+    path = tmp_path / "riff.mid"
+    path.write_bytes(track_file(b"\x00\x90\x3c\x40\x07\x3c\x00\x01\xff\x2f\x00", division=100))
+    riff = read_riff(str(path))
+    assert list(riff.notes) == [(0x3c, 7)] and riff.division == 100 and riff.rhythm_ticks == (7,)
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"MThd\x00",
+    # Truncated meta event
+    track_file(b"\x00\x90\x3c\x40\x01\x3c\x00\x00\xff"),
+    # Running status without a status
+    track_file(b"\x00\x3c\x40"),
+    # SMPTE division
+    encode_mthd(480)[:-2] + struct.pack(">h", -25 * 256 + 40) + riff_bytes(0)[14:],
+    # Note never released
+    track_file(b"\x00\x90\x3c\x40\x01\xff\x2f\x00"),
+])
+def test_invalid_input(data):
+    with pytest.raises(MIDIReadingError):
+        verify(data, "riff")
+
+
+def test_mutated_input():
+    # Corrupt files are either read or rejected with a MIDIReadingError, never another exception
+    rng = random.Random(0)
+    originals = [riff_bytes(index, index % 2 == 0) for index in range(10)]
+    for _ in range(2000):
+        data = bytearray(rng.choice(originals))
+        for _ in range(rng.randint(1, 3)):
+            position = rng.randrange(len(data))
+            if rng.random() < 0.5:
+                data[position] = rng.randrange(256)
+            else:
+                del data[position:]
+                data += b"\x00" if not data else b""
+        try:
+            verify(bytes(data), "riff")
+        except MIDIReadingError:
+            pass
+
+
+def test_generated_riffs_verify():
+    for index in range(50):
+        assert len(verify(riff_bytes(index, index % 2 == 0), "riff")) == 1 + index % 16
+
+
+def test_main(tmp_path, capsys):
+    for index in range(3):
+        (tmp_path / "{}.mid".format(index)).write_bytes(riff_bytes(index))
+    (tmp_path / "3.mid").write_bytes(riff_bytes(3)[:-1])
+    with pytest.raises(SystemExit) as error:
+        reader.main([str(tmp_path)])
+    assert error.value.code == 1
+    assert capsys.readouterr().out.endswith("4 files, 6 notes, 1 failures\n")
+    with pytest.raises(SystemExit) as error:
+        reader.main([str(tmp_path / "missing")])
+    assert error.value.code == 1
+
+
+def test_main_container(tmp_path, capsys):
+    path = str(tmp_path / "riffs.riffs")
+    with ContainerSink(path) as sink:
+        for index in range(5):
+            sink.add(index, riff_bytes(index))
+    reader.main([path])
+    assert capsys.readouterr().out.endswith("5 files, 15 notes, 0 failures\n")
+    # A file that is not a container
+    (tmp_path / "riff.mid").write_bytes(riff_bytes(0))
+    with pytest.raises(SystemExit) as error:
+        reader.main([str(tmp_path / "riff.mid")])
+    assert error.value.code == 1
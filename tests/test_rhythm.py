@@ -0,0 +1,68 @@
+import random
+from collections import Counter
+
+import pytest
+
+from midi import Riff, NoteLength
+from rhythm import MAX_RHYTHM_UNITS, count_rhythms, fill_rhythm, iter_rhythm
+
+
+def compositions(ticks, total):
+    # Every sequence of the lengths lasting exactly total, by brute force
+    if total == 0:
+        return [()]
+    return [(length,) + rest for length in sorted(set(ticks)) if length <= total
+            for rest in compositions(ticks, total - length)]
+
+
+@pytest.mark.parametrize("ticks, total", [
+    ([1, 2], 6), ([2, 3], 12), ([120, 240, 480], 1920), ([960], 1920), ([3, 5], 7), ([4], 6),
+])
+def test_counts(ticks, total):
+    assert count_rhythms(ticks, total) == len(compositions(ticks, total))
+
+
+def test_exact_sums():
+    rng = random.Random(0)
+    for _ in range(200):
+        ticks = rng.sample([30, 60, 90, 120, 240, 480, 960, 1920], rng.randint(1, 4))
+        total = 1920 * rng.randint(1, 8)
+        if not count_rhythms(ticks, total):
+            with pytest.raises(ValueError):
+                fill_rhythm(ticks, total, rng)
+            continue
+        lengths = fill_rhythm(ticks, total, rng)
+        assert sum(lengths) == total
+        assert set(lengths) <= set(ticks)
+
+
+def test_uniform():
+    # 13 rhythms of 6 ticks made of 1 and 2 tick notes, each drawn about 1000 times
+    rng = random.Random(0)
+    draws = Counter(tuple(iter_rhythm([1, 2], 6, rng)) for _ in range(13000))
+    assert set(draws) == set(compositions([1, 2], 6))
+    assert all(900 < count < 1100 for count in draws.values())
+
+
+def test_numpy_generator():
+    numpy = pytest.importorskip("numpy")
+    lengths = fill_rhythm([1, 2, 4], 64, numpy.random.default_rng(0))
+    assert sum(lengths) == 64
+
+
+@pytest.mark.parametrize("ticks, total", [([0, 30], 480), ([30], 0), ([-30], 480), ([1], MAX_RHYTHM_UNITS + 1)])
+def test_invalid(ticks, total):
+    with pytest.raises(ValueError):
+        count_rhythms(ticks, total)
+    with pytest.raises(ValueError):
+        fill_rhythm(ticks, total, random.Random(0))
+
+
+def test_riff_bars():
+    for seed in range(20):
+        riff = Riff(bars=2, beats_per_bar=3, allowed_rhythm=[NoteLength.QUARTER, NoteLength.EIGHTH], seed=seed)
+        riff.populate()
+        assert sum(riff.notes.lengths) == 2 * 3 * 480
+        assert len(riff.notes) == riff.number_notes
+    with pytest.raises(ValueError):
+        Riff(bars=0)
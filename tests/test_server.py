@@ -0,0 +1,119 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from batch import generate_chunk
+from midi import Riff, NoteLength, MTHD_HEADER, encode, encode_mthd
+from server import RiffServer
+
+
+def decode_chunked(data):
+    # Body of a chunked response and what follows it
+    body = b""
+    while True:
+        size, _, data = data.partition(b"\r\n")
+        size = int(size, 16)
+        if not size:
+            return body, data[2:]
+        body += data[:size]
+        data = data[size + 2:]
+
+
+async def fetch(port, *targets, method="GET"):
+    # Sends the requests on a single connection, the last one closes it
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for index, target in enumerate(targets):
+        connection = "close" if index == len(targets) - 1 else "keep-alive"
+        writer.write("{} {} HTTP/1.1\r\nHost: localhost\r\nConnection: {}\r\n\r\n".format(method, target,
+                                                                                         connection).encode())
+    data = await reader.read()
+    writer.close()
+    responses = []
+    while data:
+        head, _, data = data.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        headers = dict(line.split(": ", 1) for line in lines[1:])
+        if "Content-Length" in headers:
+            length = int(headers["Content-Length"])
+            body, data = data[:length], data[length:]
+        else:
+            body, data = decode_chunked(data)
+        responses.append((int(lines[0].split()[1]), headers, body))
+    return responses
+
+
+def run(*targets, method="GET", processes=False, **kwargs):
+    async def main():
+        # Threads are enough to check the responses and start much faster than the worker processes
+        riff_server = RiffServer(workers=2, executor=None if processes else ThreadPoolExecutor(2), **kwargs)
+        server = await riff_server.start(port=0)
+        try:
+            return await fetch(server.sockets[0].getsockname()[1], *targets, method=method)
+        finally:
+            server.close()
+            await server.wait_closed()
+            riff_server.close()
+    return asyncio.run(main())
+
+
+def riff_bytes(**options):
+    riff = Riff(**options)
+    riff.populate()
+    return bytes(encode(riff))
+
+
+def test_riff():
+    (status, headers, body), = run("/riff?seed=3&notes=8&rhythm=QUARTER,EIGHTH")
+    assert status == 200 and headers["Content-Type"] == "audio/midi"
+    assert body == riff_bytes(seed=3, number_notes=8, allowed_rhythm=[NoteLength.QUARTER, NoteLength.EIGHTH])
+
+
+def test_riffs():
+    (status, headers, body), = run("/riffs?seed=1&notes=4&count=5")
+    assert status == 200 and headers["Transfer-Encoding"] == "chunked"
+    tracks = b"".join(data[MTHD_HEADER.size:] for data in generate_chunk(1, 0, 5, number_notes=4))
+    assert body == encode_mthd(480, 5) + tracks
+
+
+def test_keep_alive():
+    responses = run("/riff?seed=1", "/riff?seed=2", "/missing", "/riff?seed=1")
+    assert [status for status, _, _ in responses] == [200, 200, 404, 200]
+    assert responses[0][2] == responses[3][2] != responses[1][2]
+    assert responses[0][1]["Connection"] == "keep-alive" and responses[3][1]["Connection"] == "close"
+
+
+@pytest.mark.parametrize("target, status", [
+    ("/missing", 404),
+    ("/riff?notes=many", 400),
+    ("/riff?notes=0", 400),
+    ("/riff?scale=BLUES", 400),
+    # Sixty-fourth notes do not last a whole number of ticks
+    ("/riff?division=100", 400),
+    # Whole notes cannot fill a bar of 3 quarter notes
+    ("/riff?bars=1&beats_per_bar=3&rhythm=WHOLE", 400),
+    ("/riffs?count=1000&notes=100000", 413),
+    ("/riffs?count=65535&bars=1000", 413),
+])
+def test_errors(target, status):
+    (response_status, headers, body), = run(target)
+    assert response_status == status and headers["Content-Type"] == "text/plain" and body
+
+
+def test_method():
+    (status, _, _), = run("/riff", method="POST")
+    assert status == 405
+
+
+def test_busy():
+    responses = run("/riffs?count=5", "/riffs?count=4", max_pending=4)
+    assert [status for status, _, _ in responses] == [503, 200]
+    assert responses[0][1]["Retry-After"] == "1"
+
+
+def test_process_pool():
+    # Default executor, with worker processes that do not hold the client sockets
+    responses = run("/riff?seed=4&notes=6", "/riff?seed=4&bars=2", processes=True)
+    assert [status for status, _, _ in responses] == [200, 200]
+    assert responses[0][2] == riff_bytes(seed=4, number_notes=6)
+    assert responses[1][2] == riff_bytes(seed=4, bars=2)
@@ -0,0 +1,107 @@
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from midi import Riff, MIDIWritingError, encode
+from reader import parse, parse_notes, open_container, iter_container
+from sinks import DirectorySink, TarSink, ZipSink, MultiTrackSink, ContainerSink, open_sink
+
+NAMES = ["riff_{:07d}.mid".format(index) for index in range(20)]
+
+
+def riff_bytes(index, division=480):
+    riff = Riff(number_notes=1 + index % 16, seed=index, division=division)
+    riff.populate()
+    return bytes(encode(riff))
+
+
+RIFFS = [riff_bytes(index) for index in range(20)]
+
+
+def fill(sink, riffs=RIFFS):
+    with sink:
+        for index, data in enumerate(riffs):
+            sink.add(index, data)
+
+
+def test_directory(tmp_path):
+    fill(DirectorySink(str(tmp_path / "riffs")))
+    assert sorted(os.listdir(str(tmp_path / "riffs"))) == NAMES
+    assert [(tmp_path / "riffs" / name).read_bytes() for name in NAMES] == RIFFS
+
+
+def test_tar(tmp_path):
+    fill(TarSink(str(tmp_path / "riffs.tar")))
+    with tarfile.open(str(tmp_path / "riffs.tar")) as archive:
+        assert archive.getnames() == NAMES
+        assert [archive.extractfile(name).read() for name in NAMES] == RIFFS
+
+
+def test_zip(tmp_path):
+    fill(ZipSink(str(tmp_path / "riffs.zip")))
+    with zipfile.ZipFile(str(tmp_path / "riffs.zip")) as archive:
+        assert archive.namelist() == NAMES
+        assert [archive.read(name) for name in NAMES] == RIFFS
+
+
+def test_multi_track(tmp_path):
+    path = tmp_path / "riffs.mid"
+    fill(MultiTrackSink(str(path)))
+    header, notes = parse(path.read_bytes())
+    assert header.format == 1 and header.tracks == len(RIFFS)
+    assert list(notes) == [note for data in RIFFS for note in parse_notes(data)]
+
+
+def test_multi_track_division(tmp_path):
+    with MultiTrackSink(str(tmp_path / "riffs.mid"), division=96) as sink:
+        sink.add(0, riff_bytes(0, division=96))
+        with pytest.raises(MIDIWritingError):
+            sink.add(1, riff_bytes(1))
+
+
+def test_container(tmp_path):
+    path = str(tmp_path / "riffs.riffs")
+    fill(ContainerSink(path))
+    with open_container(path) as container:
+        assert len(container) == len(RIFFS)
+        assert [bytes(data) for data in container] == RIFFS
+        assert bytes(container[-1]) == RIFFS[-1]
+        with pytest.raises(IndexError):
+            container[len(RIFFS)]
+    assert list(iter_container(path)) == [parse_notes(data) for data in RIFFS]
+
+
+def test_container_append(tmp_path):
+    path = str(tmp_path / "riffs.riffs")
+    fill(ContainerSink(path), RIFFS[:10])
+    # Interrupted run, the riffs are written but not the index
+    sink = ContainerSink(path)
+    sink.add(10, RIFFS[-1])
+    sink.file.close()
+    with open_container(path) as container:
+        assert [bytes(data) for data in container] == RIFFS[:10]
+    with ContainerSink(path) as sink:
+        for index in range(10, 20):
+            sink.add(index, RIFFS[index])
+    with open_container(path) as container:
+        assert [bytes(data) for data in container] == RIFFS
+
+
+def test_container_invalid(tmp_path):
+    path = tmp_path / "riffs.riffs"
+    path.write_bytes(RIFFS[0])
+    with pytest.raises(MIDIWritingError):
+        ContainerSink(str(path))
+    assert path.read_bytes() == RIFFS[0]
+
+
+@pytest.mark.parametrize("name, kind", [
+    ("riffs", DirectorySink), ("riffs.tar", TarSink), ("riffs.zip", ZipSink), ("riffs.mid", MultiTrackSink),
+    ("riffs.midi", MultiTrackSink), ("riffs.riffs", ContainerSink),
+])
+def test_open_sink(tmp_path, name, kind):
+    sink = open_sink(str(tmp_path / name))
+    sink.close()
+    assert type(sink) is kind